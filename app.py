@@ -1,360 +1,3232 @@
 import os
+import math
+import asyncio
 import re
 import io
+import csv
+import json
+import time
+import queue
+import random
+import itertools
+import hashlib
+import sqlite3
 import datetime
-from flask import Flask,render_template, request, send_file, jsonify
-from openai import OpenAI
+import threading
+import contextvars
+from contextlib import contextmanager, closing
+from xml.sax.saxutils import escape as xml_escape
+import uuid
+import zipfile
+import multiprocessing
+from collections import OrderedDict, deque
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FuturesTimeoutError, CancelledError as FuturesCancelledError
+from concurrent.futures.process import BrokenProcessPool
+import click
+from werkzeug.wsgi import ClosingIterator
+from werkzeug.middleware.proxy_fix import ProxyFix
+from flask import (Flask,render_template, request, send_file, jsonify, Response, stream_with_context, g,
+                   make_response)
+from flask.cli import with_appcontext
+from markupsafe import Markup
 from dotenv import load_dotenv
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_LEFT
-from reportlab.lib.units import inch
+# openai (with httpx and pydantic) and reportlab are imported on first use,
+# see get_client() and the PDF Rendering section: importing them up front
+# dominated the cold start of new instances.
 
 # --- Configuration ---
 load_dotenv()  # Load environment variables from .env file
 
-app = Flask(__name__)
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
 if not openai_api_key:
-    raise ValueError("OPENAI_API_KEY environment variable not set.")
-
-# It's better to initialize the client once
-try:
-    client = OpenAI(api_key=openai_api_key)
-except Exception as e:
-    raise RuntimeError(f"Failed to initialize OpenAI client: {e}")
-
-
-# --- SOP Data Storage ---
-# (Storing SOPs directly here for simplicity in a single file)
-# In a larger app, these might come from a database or config files.
-SOP_DATA = {
-    "Ideal Client Profile (ICP) Definition": """
-    **Objective:** To deeply understand and document the target audience(s) for the EdTech client's products/services to inform all subsequent marketing efforts.
-    **Timeline:** 1-2 Weeks
-    **Checklist:**
-    - Client Kick-off Meeting (Understand current view, gather data, define problem)
-    - Market Research (Competitor analysis, industry trends, online communities)
-    - Data Analysis (Website/app analytics, sales data, CRM data)
-    - Qualitative Research (Surveys, interviews with customers/prospects/stakeholders)
-    - Synthesize Findings (Identify demographics, psychographics, pain points, watering holes)
-    - Create Buyer Personas (Develop 2-4 detailed personas)
-    - Validation & Sign-off (Present to client, revise, get approval)
-    - Documentation (Store finalized ICPs/Personas)
-    """,
-    "Brand Building & Brand Assets": """
-    **Objective:** To establish a clear, compelling, and consistent brand identity that resonates with the target EdTech audience and differentiates the client.
-    **Timeline:** 2-4 Weeks
-    **Checklist:**
-    - Brand Discovery Workshop (Mission, Vision, Values, USP, Archetype, Voice)
-    - Competitor Brand Analysis (Visuals, messaging, differentiation opportunities)
-    - Messaging Framework Development (Core message, value props, elevator pitch)
-    - Visual Identity Development (Logo, color palette, typography, imagery style)
-    - Core Brand Asset Creation (Templates: biz card, letterhead, presentation, email sig, social profiles)
-    - Brand Guidelines Document (Compile all elements, usage rules)
-    - Client Review & Approval (Present concepts, iterate, get sign-off)
-    - Asset Delivery & Storage (Deliver files, store centrally)
-    """,
-    "Creating Social Presence & Positioning": """
-    **Objective:** To establish and optimize the client's presence on relevant social media platforms, positioning them effectively.
-    **Timeline:** 1-2 Weeks (Initial Setup & Strategy)
-    **Checklist:**
-    - Platform Selection (Based on ICP watering holes: LinkedIn, FB, IG, TikTok, YouTube etc.)
-    - Profile Creation & Optimization (Consistent handles, optimized bio, logo/banners, links)
-    - Content Strategy Outline (Content pillars: Tips, Spotlights, News, Success Stories, Q&A; Format mix; Frequency)
-    - Positioning Strategy (Define relative position vs. competitors)
-    - Initial Content Calendar (Plan first 2-4 weeks)
-    - Hashtag Strategy (Research branded, community, niche hashtags)
-    - Client Review & Approval (Present strategy, profiles, calendar)
-    - Go Live & Initial Monitoring
-    """,
-    "Creating Web Presence (Website Building)": """
-    **Objective:** To design, build, and launch a user-friendly, conversion-focused website as the central online hub.
-    **Timeline:** 4-12 Weeks (Depending on complexity)
-    **Checklist:**
-    - Define Website Goals & Strategy (Lead gen, sales, info hub; User paths; Integrations needed)
-    - Sitemap & Architecture (Logical structure, navigation plan)
-    - Platform & Hosting Selection (CMS: WordPress+LMS, Teachable/Thinkific, custom; Reliable hosting)
-    - Wireframing & Prototyping (Low/high fidelity mockups, mobile-responsive design)
-    - Content Gathering & Creation (Collect/write copy, images, videos, course details, testimonials)
-    - Website Development (Build based on designs, implement features, integrate plugins)
-    - On-Page SEO Implementation (Keywords, titles, metas, headings, alt text, structure, speed)
-    - Integration Setup & Testing (Forms, email, payment, CRM, analytics)
-    - Quality Assurance & Testing (Cross-browser/device, links, speed, forms, responsiveness)
-    - Client Training (If applicable)
-    - Pre-Launch Checklist (Final SEO, favicon, SSL, backup, redirects, tracking verification)
-    - Launch & Post-Launch Monitoring (Deploy, monitor analytics, submit to search engines)
-    """,
-    "Consistent Blog Writing": """
-    **Objective:** To regularly create valuable, SEO-optimized blog content to attract the target audience, build authority, and support lead generation.
-    **Timeline:** Ongoing (Cycle per post: ~1-3 days)
-    **Checklist:**
-    - Content Strategy & Keyword Research (ICP needs, goals, keywords, competitor analysis, pillars)
-    - Content Calendar Planning (Monthly schedule, topics, keywords, CTAs)
-    - Topic Ideation & Outlining (Angle, title, detailed outline, H2s/H3s, links, CTA placement)
-    - Writing & Drafting (Engaging, valuable, clear content for audience; Brand voice)
-    - Editing & Proofreading (Grammar, spelling, clarity, flow, accuracy)
-    - SEO Optimization (Keyword integration, title/meta, headings, internal/external links, image alt text)
-    - Visuals & Formatting (Relevant images/infographics, web readability)
-    - Call-to-Action (CTA) Integration (Clear, relevant CTAs linking correctly)
-    - Client Approval (If required)
-    - Publishing (Upload to CMS, categories/tags, featured image)
-    - Promotion (Share on social, email newsletter, outreach)
-    - Performance Tracking (Traffic, time on page, bounce rate, keyword rankings, conversions)
-    """,
-    "Social Media Content Generation (Video & Written)": """
-    **Objective:** To consistently create and publish engaging written and video content across selected platforms aligned with brand strategy.
-    **Timeline:** Ongoing (Daily/Weekly activity)
-    **Checklist:**
-    - Content Calendar Management (Weekly/Monthly plan: topic, format, caption, hashtags, CTA)
-    - Written Content Creation (Engaging captions, platform best practices, CTAs, text posts, video scripts)
-    - Visual Content Creation (Graphics: Canva/Adobe; Stock photos/client images; Infographics, carousels; Optimize dimensions)
-    - Video Content Creation (Pre-prod: script/storyboard; Prod: filming/recording; Post-prod: editing, branding, captions, music; Format optimization)
-    - Content Review & Approval (Internal quality check, client approval if needed)
-    - Scheduling & Publishing (Use tools like Buffer/Hootsuite; Manual publishing for some formats)
-    - Community Management & Engagement (Monitor daily, respond promptly, proactive engagement)
-    - Performance Monitoring & Reporting (Track metrics per platform, analyze top content, report insights)
-    """,
-    "Ideate Revenue Streams from Content": """
-    **Objective:** To strategically leverage content to create new or optimize existing revenue streams.
-    **Timeline:** 1-2 Weeks (Initial Ideation), Ongoing (Refinement)
-    **Checklist:**
-    - Content Audit & Performance Analysis (Review inventory, identify popular topics/formats)
-    - ICP & Offer Alignment (Revisit needs, analyze current offerings, identify gaps)
-    - Brainstorm Monetization Opportunities (Lead Magnets, Low-Ticket Offers, Content Upsells, Webinar entries, Memberships, Direct promotion, Affiliate)
-    - Assess Feasibility & Potential (Estimate effort vs. ROI, prioritize)
-    - Develop Offer Concepts (Outline deliverables, value prop, pricing, funnel fit)
-    - Client Presentation & Discussion (Present ideas, rationale, decide collaboratively)
-    - Action Plan (Outline steps for approved ideas)
-    - Documentation (Record process and decisions)
-    """,
-    "Specific Funnel Building (Price Point Based)": """
-    **Objective:** To design, build, and test marketing funnels tailored to the offer's price point to guide prospects towards conversion.
-    **Timeline:** 2-6 Weeks per funnel
-    **Checklist:**
-    - Define Funnel Goal & Offer (Specific objective, product, ICP segment, price point)
-    - Select Funnel Type (Low-Ticket: Direct Sale; Mid-Ticket: Webinar/Workshop; High-Ticket: Application/Call)
-    - Map Funnel Stages & User Journey (Outline steps from awareness to post-conversion)
-    - Technology & Tool Setup (Landing Page Builder, Email Marketing, Webinar Platform, Scheduler, Payment, CRM, Analytics)
-    - Content Creation for Funnel Assets (Copywriting: Ads, Pages, Emails; Visuals: Designs, graphics, slides; Webinar content; Application Qs)
-    - Build Funnel Pages & Automations (Build pages, set up email sequences/rules, integrate tools)
-    - Tracking Implementation (Install pixels, set up goals/events in Analytics/Ads, use UTMs)
-    - Testing (Full user flow, forms, emails, integrations, payments, links, devices/browsers)
-    - Pre-Launch Review (Check all assets, verify tracking, get client sign-off)
-    - Launch Funnel (Activate automations, make pages live, start traffic)
-    - Initial Monitoring (Check analytics frequently for issues)
-    """,
-    "Traffic Generation (Performance, Influencer, Organic)": """
-    **Objective:** To drive qualified traffic from multiple sources into the defined marketing funnels.
-    **Timeline:** Ongoing
-    **Checklist:**
-    - Define Traffic Goals & Budget (Volume needed, budget allocation, target CPL/CPA)
-    - Performance Marketing (Paid Ads) Setup & Management (Platform choice, campaign structure, audience targeting, keyword research, ad creative dev, landing page alignment, bidding/budgeting, tracking setup, launch, ongoing optimization: A/B tests, bid/budget adjustments, scaling/pausing)
-    - Influencer Marketing Execution (Identification/vetting, outreach/negotiation, campaign brief, content review, tracking links/codes, relationship mgmt)
-    - Organic Marketing Execution (SEO: technical, on-page, content, backlinks; Social Media: content calendar, engagement; Email Marketing: newsletters, nurturing, promotions)
-    - Traffic Allocation & Monitoring (Track sources via UTMs, analyze channel performance, adjust budget/effort based on ROI)
-    """,
-    "KPI Tracking & Funnel Optimization": """
-    **Objective:** To continuously monitor KPIs, analyze funnel performance, identify bottlenecks, and implement data-driven optimizations to maximize ROI.
-    **Timeline:** Ongoing (Daily/Weekly/Monthly analysis cycles)
-    **Checklist:**
-    - Define Key Performance Indicators (KPIs) (Business: ROI, CAC, CLTV; Traffic: Sessions, CTR, CPC; Engagement: Bounce Rate, Session Duration; Funnel Specific: CVRs, CPL, Rates - Reg/Attend/Apply/Book/Close; Sales: CVR, AOV, ROAS, Revenue)
-    - Setup Tracking & Reporting Tools (GA Goals/Events, Ad Pixels, CRM, Dashboard: Data Studio/Spreadsheet)
-    - Establish Reporting Cadence (Daily checks, Weekly analysis, Monthly deep dive, Quarterly review)
-    - Data Analysis & Interpretation (Compare vs. history/goals, identify bottlenecks, segment data, analyze creative/LP performance)
-    - Hypothesis & A/B Testing (Formulate hypotheses, prioritize tests, systematically test elements, ensure statistical significance)
-    - Implement Winning Variations (Document results, roll out winners, pause losers)
-    - Iterate & Refine (Continuously repeat cycle, apply learnings, stay updated)
-    - Client Reporting & Communication (Regular reports: KPIs, insights, tests, results, recommendations; Focus on ROI; Transparency)
+    # Not fatal at import, so health checks still answer; generation calls fail until it is set
+    print("Warning: OPENAI_API_KEY environment variable not set.")
+
+# Generation settings (shared by the API call and the cache key)
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.7"))
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "3000"))
+SYSTEM_MESSAGE = "You are a professional Performance Marketing Consultant specializing in EdTech generating a client blueprint."
+
+# Blueprint cache settings. The memory tier is per process; the SQLite tier
+# is shared by every gunicorn worker on the host. Set BLUEPRINT_CACHE_DB to
+# an empty string to disable the disk tier.
+BLUEPRINT_CACHE_SIZE = int(os.getenv("BLUEPRINT_CACHE_SIZE", "128"))
+BLUEPRINT_CACHE_TTL = int(os.getenv("BLUEPRINT_CACHE_TTL", "3600"))  # seconds
+BLUEPRINT_CACHE_DISK_TTL = int(os.getenv("BLUEPRINT_CACHE_DISK_TTL", "86400"))  # seconds
+BLUEPRINT_CACHE_DB = os.getenv("BLUEPRINT_CACHE_DB", os.path.join(".cache", "blueprint_cache.sqlite3"))
+
+# Background job settings for the opt-in async mode of /generate_blueprint
+BLUEPRINT_JOB_WORKERS = int(os.getenv("BLUEPRINT_JOB_WORKERS", "2"))
+BLUEPRINT_JOB_QUEUE_DEPTH = int(os.getenv("BLUEPRINT_JOB_QUEUE_DEPTH", "16"))  # queued + running
+BLUEPRINT_JOB_RESULT_TTL = int(os.getenv("BLUEPRINT_JOB_RESULT_TTL", "900"))  # seconds
+BLUEPRINT_JOB_MAX_STORED = int(os.getenv("BLUEPRINT_JOB_MAX_STORED", "64"))  # finished jobs kept in memory
+
+# Generation mode: "single" asks for the whole blueprint in one completion,
+# "parallel" fans out one smaller completion per SOP section and
+# "structured" asks for one JSON object keyed by section title, then
+# regenerates only the sections it lacks. Requests can override it with a
+# generation_mode field.
+BLUEPRINT_GENERATION_MODE = os.getenv("BLUEPRINT_GENERATION_MODE", "single")
+# Section completions share one process-wide pool. Below the number of
+# sections (11 with the bundled catalog) even a lone blueprint runs in
+# several waves; above it, concurrent parallel-mode requests can overlap
+# instead of queueing behind each other, at the cost of more simultaneous
+# API calls (and rate limit headroom) per worker.
+BLUEPRINT_SECTION_CONCURRENCY = int(os.getenv("BLUEPRINT_SECTION_CONCURRENCY", "16"))
+BLUEPRINT_SECTION_MAX_TOKENS = int(os.getenv("BLUEPRINT_SECTION_MAX_TOKENS", "600"))
+BLUEPRINT_SECTION_RETRIES = int(os.getenv("BLUEPRINT_SECTION_RETRIES", "2"))
+# Section cache (memory entries; shares the blueprint cache's TTLs and SQLite file)
+BLUEPRINT_SECTION_CACHE_SIZE = int(os.getenv("BLUEPRINT_SECTION_CACHE_SIZE", "1024"))
+
+# SOP catalog files (see the SOP Catalog section) and how often their
+# mtimes are checked for a hot reload
+BLUEPRINT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+BLUEPRINT_SOP_CATALOG = os.getenv("BLUEPRINT_SOP_CATALOG", os.path.join(BLUEPRINT_DATA_DIR, "sops.json"))
+BLUEPRINT_SOP_PACKAGES = os.getenv("BLUEPRINT_SOP_PACKAGES", os.path.join(BLUEPRINT_DATA_DIR, "sop_packages.json"))
+BLUEPRINT_SOP_RELOAD_INTERVAL = float(os.getenv("BLUEPRINT_SOP_RELOAD_INTERVAL", "2"))  # seconds
+
+# Bulk generation (flask generate-batch / POST /generate_blueprint/batch)
+BLUEPRINT_BATCH_CONCURRENCY = int(os.getenv("BLUEPRINT_BATCH_CONCURRENCY", "4"))
+BLUEPRINT_BATCH_DIR = os.getenv("BLUEPRINT_BATCH_DIR", os.path.join(".cache", "batches"))  # one PDF per record hash
+# Checkpoints older than this are deleted when the next batch starts (defaults to the disk cache TTL)
+BLUEPRINT_BATCH_TTL = int(os.getenv("BLUEPRINT_BATCH_TTL", str(BLUEPRINT_CACHE_DISK_TTL)))  # seconds
+
+# PDF rendering: process pool size (0 renders on the calling thread) and per-render timeout
+BLUEPRINT_PDF_PROCESSES = int(os.getenv("BLUEPRINT_PDF_PROCESSES", str(min(4, os.cpu_count() or 1))))
+BLUEPRINT_PDF_TIMEOUT = float(os.getenv("BLUEPRINT_PDF_TIMEOUT", "60"))  # seconds
+
+# Artifact store for re-downloading generated blueprints
+BLUEPRINT_ARTIFACT_DIR = os.getenv("BLUEPRINT_ARTIFACT_DIR", os.path.join(".cache", "artifacts"))
+BLUEPRINT_ARTIFACT_MAX_BYTES = int(os.getenv("BLUEPRINT_ARTIFACT_MAX_BYTES", str(500 * 1024 * 1024)))
+
+# Requests slower than this (seconds) have their stage breakdown logged; 0 disables
+BLUEPRINT_SLOW_REQUEST_SECONDS = float(os.getenv("BLUEPRINT_SLOW_REQUEST_SECONDS", "45"))
+
+# Request coalescing: how long a caller waits for an identical in-flight
+# generation, and an optional SQLite file that extends it across workers
+BLUEPRINT_COALESCE_WAIT = float(os.getenv("BLUEPRINT_COALESCE_WAIT", "180"))  # seconds
+BLUEPRINT_COALESCE_LEASE_DB = os.getenv("BLUEPRINT_COALESCE_LEASE_DB", "")
+
+# OpenAI transport. The keep-alive pool defaults to the number of threads
+# that can call the API at once; retries are ours (the SDK's are disabled)
+# so they can share one budget.
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", str(
+    max(10, BLUEPRINT_JOB_WORKERS + BLUEPRINT_SECTION_CONCURRENCY + BLUEPRINT_BATCH_CONCURRENCY + 4))))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))  # seconds
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))  # seconds
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "90"))  # seconds between bytes
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))  # seconds
+OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "8"))  # seconds
+OPENAI_RETRY_BUDGET_RATIO = float(os.getenv("OPENAI_RETRY_BUDGET_RATIO", "0.1"))  # retries per call
+OPENAI_RETRY_BUDGET_MAX = float(os.getenv("OPENAI_RETRY_BUDGET_MAX", "10"))  # burst allowance
+OPENAI_HEDGE = os.getenv("OPENAI_HEDGE", "0").strip().lower() in ('1', 'true', 'yes', 'on')
+OPENAI_HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "95"))
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+OPENAI_HEDGE_MIN_DELAY = float(os.getenv("OPENAI_HEDGE_MIN_DELAY", "2"))  # seconds
+
+# Admission control and load-based routing for generation requests (see
+# the Admission Control section). BLUEPRINT_RATE_LIMIT_PER_MINUTE=0 turns
+# off the per-client limit.
+BLUEPRINT_RATE_LIMIT_PER_MINUTE = float(os.getenv("BLUEPRINT_RATE_LIMIT_PER_MINUTE", "30"))
+BLUEPRINT_RATE_LIMIT_BURST = float(os.getenv("BLUEPRINT_RATE_LIMIT_BURST", "10"))
+BLUEPRINT_MAX_IN_FLIGHT = int(os.getenv("BLUEPRINT_MAX_IN_FLIGHT", "32"))  # per worker process
+BLUEPRINT_MAX_QUEUE = int(os.getenv("BLUEPRINT_MAX_QUEUE", "64"))
+BLUEPRINT_QUEUE_TIMEOUT = float(os.getenv("BLUEPRINT_QUEUE_TIMEOUT", "30"))  # seconds
+BLUEPRINT_LATENCY_SLO = float(os.getenv("BLUEPRINT_LATENCY_SLO", "60"))  # seconds, p90 of generation
+BLUEPRINT_LATENCY_MIN_SAMPLES = int(os.getenv("BLUEPRINT_LATENCY_MIN_SAMPLES", "10"))
+BLUEPRINT_DEGRADE_QUEUE_DEPTH = int(os.getenv("BLUEPRINT_DEGRADE_QUEUE_DEPTH", "8"))
+OPENAI_FAST_MODEL = os.getenv("OPENAI_FAST_MODEL", "gpt-4o-mini")
+BLUEPRINT_DEGRADED_MAX_TOKENS = int(os.getenv("BLUEPRINT_DEGRADED_MAX_TOKENS", "1800"))
+# The rate limit keys on the client address. Behind reverse proxies under a
+# WSGI server, set BLUEPRINT_PROXY_HOPS to the number of proxies that append
+# to X-Forwarded-For; the client is read that many entries from the right,
+# so a forged header cannot pick its own bucket. 0 ignores the header.
+# asgi.py leaves this to uvicorn (see FORWARDED_ALLOW_IPS there).
+BLUEPRINT_PROXY_HOPS = int(os.getenv("BLUEPRINT_PROXY_HOPS", "0"))
+
+# Async (ASGI) serving, see asgi.py. The async client's pool bounds how many
+# generations one worker can have in flight; on shutdown in-flight requests
+# and background jobs get BLUEPRINT_DRAIN_SECONDS to finish.
+OPENAI_ASYNC_POOL_SIZE = int(os.getenv("OPENAI_ASYNC_POOL_SIZE", "500"))
+BLUEPRINT_DRAIN_SECONDS = float(os.getenv("BLUEPRINT_DRAIN_SECONDS", "120"))
+
+# Preload ReportLab, the PDF workers and an API connection in the background at startup
+BLUEPRINT_WARMUP = os.getenv("BLUEPRINT_WARMUP", "1").strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def build_openai_client(api_key, base_url=None):
+    """ OpenAI client on a shared keep-alive pool with explicit timeouts """
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+
+    timeout = httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    http_client = DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=OPENAI_POOL_SIZE,
+                            max_keepalive_connections=OPENAI_POOL_SIZE,
+                            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY),
+        timeout=timeout,
+    )
+    return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client,
+                  timeout=timeout, max_retries=0)
+
+
+def build_async_openai_client(api_key, base_url=None):
+    """ AsyncOpenAI counterpart of build_openai_client for the ASGI mode """
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    timeout = httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_connections=OPENAI_ASYNC_POOL_SIZE,
+                            max_keepalive_connections=OPENAI_ASYNC_POOL_SIZE,
+                            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY),
+        timeout=timeout,
+    )
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client,
+                       timeout=timeout, max_retries=0)
+
+
+# It's better to initialize the client once, but only when it is first needed
+client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """ The shared OpenAI client, built (and the SDK imported) on first use """
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                if not openai_api_key:
+                    raise RuntimeError("OPENAI_API_KEY environment variable not set.")
+                try:
+                    client = build_openai_client(openai_api_key)
+                except Exception as e:
+                    raise RuntimeError(f"Failed to initialize OpenAI client: {e}")
+    return client
+
+
+# --- SOP Catalog ---
+# The SOPs live in data/sops.json and named packages of them (e.g.
+# "funnel-only") in data/sop_packages.json. Both are parsed and indexed
+# into a SopCatalog, which is rebuilt when either file changes: the mtimes
+# are checked at most every BLUEPRINT_SOP_RELOAD_INTERVAL seconds, so edits
+# go live without a restart. A catalog that fails to load leaves the
+# previous one in place.
+
+SOP_REQUIRED_KEYS = ('id', 'title', 'objective')
+
+
+def package_key(name):
+    """ 'Brand Launch' and 'brand-launch' name the same package """
+    return normalize_heading(name).replace(' ', '-')
+
+
+class SopCatalog:
+    """ One version of the SOP catalog, parsed and indexed """
+
+    def __init__(self, sops, packages, version):
+        self.version = version
+        self.registry = OrderedDict((sop['title'], sop) for sop in sops)
+        # Selections name SOPs by id or by title
+        self.index = {}
+        for sop in sops:
+            self.index[sop['id']] = sop['title']
+            self.index[normalize_heading(sop['title'])] = sop['title']
+        self.field_dependencies = {sop['title']: sop['fields'] for sop in sops if sop.get('fields')}
+        self.packages = OrderedDict()
+        for name, package in packages.items():
+            titles, unknown = self.resolve(package.get('sops') or [])
+            if unknown:
+                raise ValueError(f"SOP package '{name}' lists unknown SOPs: {', '.join(unknown)}")
+            if not titles:
+                raise ValueError(f"SOP package '{name}' lists no SOPs")
+            self.packages[package_key(name)] = {"description": package.get('description', ''), "titles": titles}
+        self._prefixes = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, names):
+        """ Returns (titles in catalog order, names that match no SOP) """
+        found = set()
+        unknown = []
+        for name in names:
+            name = str(name).strip()
+            title = self.index.get(name.lower()) or self.index.get(normalize_heading(name))
+            if title is not None:
+                found.add(title)
+            elif name:
+                unknown.append(name)
+        return [title for title in self.registry if title in found], unknown
+
+    def prompt_prefix(self, titles):
+        """ The static prompt prefix for a selection of SOPs, compiled once per catalog version """
+        key = tuple(titles)
+        with self._lock:
+            prefix = self._prefixes.get(key)
+            if prefix is None:
+                prefix = build_prompt_prefix(OrderedDict((title, self.registry[title]) for title in key))
+                self._prefixes[key] = prefix
+        return prefix
+
+
+def load_sop_catalog(sops_path, packages_path=None):
+    """ Reads and validates the catalog files; raises OSError or ValueError """
+    with open(sops_path, 'rb') as f:
+        sops_bytes = f.read()
+    packages_bytes = b''
+    if packages_path and os.path.exists(packages_path):
+        with open(packages_path, 'rb') as f:
+            packages_bytes = f.read()
+
+    sops = json.loads(sops_bytes).get('sops')
+    packages = json.loads(packages_bytes).get('packages') if packages_bytes else {}
+    if not isinstance(sops, list) or not sops:
+        raise ValueError(f"{sops_path} has no 'sops' list")
+    if not isinstance(packages, dict):
+        raise ValueError(f"{packages_path} has no 'packages' mapping")
+
+    seen = set()
+    for sop in sops:
+        missing = [key for key in SOP_REQUIRED_KEYS if not isinstance(sop, dict) or not sop.get(key)]
+        if missing:
+            raise ValueError(f"SOP {sop.get('id') if isinstance(sop, dict) else sop!r} is missing {', '.join(missing)}")
+        if sop['id'] in seen or sop['title'] in seen:
+            raise ValueError(f"Duplicate SOP id or title: {sop['id']}")
+        seen.update((sop['id'], sop['title']))
+        unknown_fields = [field for field in sop.get('fields') or [] if field not in COMPANY_FIELDS]
+        if unknown_fields:
+            raise ValueError(f"SOP {sop['id']} depends on unknown fields: {', '.join(unknown_fields)}")
+        sop.setdefault('timeline', '')
+        sop.setdefault('checklist', [])
+
+    version = hashlib.sha256(sops_bytes + b'\0' + packages_bytes).hexdigest()[:12]
+    return SopCatalog(sops, packages, version)
+
+
+_sop_catalog = None
+_sop_catalog_stamp = None  # (size, mtime) of each file the current catalog was read from
+_sop_catalog_checked_at = 0.0
+_sop_catalog_lock = threading.Lock()
+
+
+def sop_catalog_stamp():
+    stamp = []
+    for path in (BLUEPRINT_SOP_CATALOG, BLUEPRINT_SOP_PACKAGES):
+        try:
+            stat = os.stat(path)
+            stamp.append((stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def get_sop_catalog():
+    """ The current SOP catalog, reloaded if its files changed """
+    global _sop_catalog, _sop_catalog_stamp, _sop_catalog_checked_at
+    catalog = _sop_catalog
+    if catalog is not None and time.monotonic() - _sop_catalog_checked_at < BLUEPRINT_SOP_RELOAD_INTERVAL:
+        return catalog
+    with _sop_catalog_lock:
+        now = time.monotonic()
+        if _sop_catalog is not None and now - _sop_catalog_checked_at < BLUEPRINT_SOP_RELOAD_INTERVAL:
+            return _sop_catalog
+        _sop_catalog_checked_at = now
+        stamp = sop_catalog_stamp()
+        if _sop_catalog is not None and stamp == _sop_catalog_stamp:
+            return _sop_catalog
+        try:
+            catalog = load_sop_catalog(BLUEPRINT_SOP_CATALOG, BLUEPRINT_SOP_PACKAGES)
+        except (OSError, ValueError) as e:
+            if _sop_catalog is None:
+                raise
+            # Not retried until the files change again
+            print(f"Warning: Keeping SOP catalog {_sop_catalog.version}, reload failed: {e}")
+            _sop_catalog_stamp = stamp
+            return _sop_catalog
+        print(f"Loaded SOP catalog {catalog.version}: {len(catalog.registry)} SOPs, "
+              f"{len(catalog.packages)} package(s).")
+        _sop_catalog, _sop_catalog_stamp = catalog, stamp
+        return catalog
+
+
+def resolve_sop_selection(company_details):
+    """ Resolves a request's `sops` (ids or titles, as a list or a comma
+    separated string of ids) and `sop_package` fields against the catalog.
+    Returns (titles, error): titles in catalog order, or None for the whole
+    catalog; unknown names are left out of titles and reported in error. """
+    catalog = get_sop_catalog()
+    selected = set()
+    errors = []
+    package = company_details.get('sop_package')
+    if package:
+        found = catalog.packages.get(package_key(str(package)))
+        if found is None:
+            errors.append(f"Unknown SOP package: {package} (available: {', '.join(catalog.packages)})")
+        else:
+            selected.update(found['titles'])
+    names = company_details.get('sops')
+    if names:
+        if isinstance(names, str):
+            names = names.split(',')
+        if not isinstance(names, (list, tuple)):
+            errors.append("sops must be a list or a comma separated string")
+        else:
+            titles, unknown = catalog.resolve(names)
+            selected.update(titles)
+            if unknown:
+                errors.append(f"Unknown SOPs: {', '.join(unknown)}")
+    titles = [title for title in catalog.registry if title in selected]
+    return (titles if titles and len(titles) < len(catalog.registry) else None), "; ".join(errors) or None
+
+
+def blueprint_sops(company_details, catalog=None):
+    """ Titles of the SOPs a blueprint covers, in catalog order """
+    catalog = catalog or get_sop_catalog()
+    titles, _ = resolve_sop_selection(company_details)
+    return [title for title in catalog.registry if titles is None or title in titles]
+
+
+# --- Prompt Template ---
+# The user prompt is a byte-stable prefix (instructions + the selected SOP
+# sections) followed by the client-specific suffix. Keeping the large static
+# block first lets the provider's automatic prompt-prefix caching reuse it
+# across requests for the same selection, which lowers input cost and time
+# to first token.
+
+def build_prompt_prefix(registry):
+    """ Compiles the static part of the blueprint prompt """
+    prefix = """
+    Act as a professional Performance Marketing Consultant specializing in EdTech.
+    You are generating a customized Performance Marketing Blueprint for a potential client.
+    This blueprint should outline the proposed strategy and execution steps, demonstrating clear value and a structured approach based on standard best practices (SOPs).
+    The goal is to convince the client to purchase these performance marketing services.
+
+    Structure the blueprint using the following Standard Operating Procedures (SOPs) as sections.
+    For EACH SOP section, do not just list the checklist. Instead, briefly explain HOW this phase will be specifically approached and tailored for THIS client, considering their product, audience, and goals. Highlight the importance and expected outcome of each phase for their specific business. Maintain a professional, confident, and action-oriented tone.
+
+    Here are the SOPs to structure the blueprint around:
+    --- SOP SECTIONS START ---
+    """
+    for title, sop in registry.items():
+        prefix += f"\n\n## {title}\nObjective: {sop['objective']}\n"
+        prefix += "(Explain the specific approach and strategy for the client based on this objective. Consider their product/service, target audience, and goals.)\n"
+    prefix += """
+    --- SOP SECTIONS END ---
+
+    Concluding Remarks: End with a brief summary statement about the holistic approach and focus on achieving the client's key business goal through measurable results and ROI.
+
+    Generate ONLY the blueprint text, formatted clearly with headings for each SOP section.
+    """
+    return prefix
+
+
+BLUEPRINT_PROMPT_SUFFIX = """
+    Client Company Details:
+    - Company Name: {company_name}
+    - Product/Service: {product_service}
+    - Target Audience (Brief): {target_audience}
+    - Key Business Goal: {business_goal}
+    - Website (Optional): {website}
+    - Current Marketing Efforts (Brief): {current_marketing}
+
+    Create the Performance Marketing Blueprint for {company_name} now.
     """
+
+
+# --- Blueprint Cache ---
+# Generations are content-addressed: the key is a hash of the normalized
+# company details together with everything else that shapes the output
+# (model, temperature, token budget and the full prompt including the SOPs).
+
+COMPANY_FIELDS = ['company_name', 'product_service', 'target_audience',
+                  'business_goal', 'website', 'current_marketing']
+
+
+def normalize_company_details(company_details):
+    """ Keeps only the known fields, with whitespace collapsed, so trivially
+    different submissions of the same form map to the same cache key. A
+    subset of SOPs is kept as 'sops', the selected titles. """
+    normalized = {}
+    for field in COMPANY_FIELDS:
+        value = company_details.get(field) or ''
+        normalized[field] = ' '.join(str(value).split())
+    titles, _ = resolve_sop_selection(company_details)
+    if titles is not None:
+        normalized['sops'] = titles
+    return normalized
+
+
+class BlueprintCache:
+    """ Two-tier cache: an in-process LRU with TTL in front of a SQLite table
+    that all workers on the host can read and write """
+
+    PURGE_INTERVAL = 300  # seconds between deletes of expired disk rows, per process
+
+    def __init__(self, max_entries, ttl, db_path=None, disk_ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path or None
+        self.disk_ttl = disk_ttl if disk_ttl is not None else ttl
+        self._entries = OrderedDict()  # key -> (expires_at, text)
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stores": 0}
+        if self.db_path:
+            try:
+                with closing(self._connect()) as conn, conn:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("CREATE TABLE IF NOT EXISTS blueprints ("
+                                 "key TEXT PRIMARY KEY, text TEXT NOT NULL, created_at REAL NOT NULL)")
+                    conn.execute("CREATE INDEX IF NOT EXISTS blueprints_created_at ON blueprints (created_at)")
+            except sqlite3.Error as e:
+                print(f"Warning: Blueprint disk cache disabled ({e})")
+                self.db_path = None
+
+    def _connect(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def record_bypass(self):
+        self._count("bypassed")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+
+        text = self._disk_get(key, now)
+        if text is not None:
+            self._memory_put(key, text, now)
+            self._count("disk_hits")
+            return text
+
+        self._count("misses")
+        return None
+
+    def put(self, key, text):
+        now = time.time()
+        self._memory_put(key, text, now)
+        self._count("stores")
+        if self.db_path:
+            with self._lock:
+                purge = now >= self._next_purge
+                if purge:
+                    self._next_purge = now + self.PURGE_INTERVAL
+            try:
+                with closing(self._connect()) as conn, conn:
+                    conn.execute("INSERT OR REPLACE INTO blueprints (key, text, created_at) VALUES (?, ?, ?)",
+                                 (key, text, now))
+                    if purge:
+                        conn.execute("DELETE FROM blueprints WHERE created_at < ?", (now - self.disk_ttl,))
+            except sqlite3.Error as e:
+                print(f"Warning: Failed to write blueprint disk cache: {e}")
+
+    def _memory_put(self, key, text, now):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (now + self.ttl, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        if not self.db_path:
+            return None
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute("SELECT text FROM blueprints WHERE key = ? AND created_at >= ?",
+                                   (key, now - self.disk_ttl)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Warning: Failed to read blueprint disk cache: {e}")
+            return None
+        return row[0] if row else None
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._entries)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+blueprint_cache = BlueprintCache(BLUEPRINT_CACHE_SIZE, BLUEPRINT_CACHE_TTL,
+                                 db_path=BLUEPRINT_CACHE_DB, disk_ttl=BLUEPRINT_CACHE_DISK_TTL)
+# Individual section texts, keyed by section prompt (see generate_blueprint_sections)
+section_cache = BlueprintCache(BLUEPRINT_SECTION_CACHE_SIZE, BLUEPRINT_CACHE_TTL,
+                               db_path=BLUEPRINT_CACHE_DB, disk_ttl=BLUEPRINT_CACHE_DISK_TTL)
+
+
+def blueprint_cache_key(prompt, max_tokens=None):
+    """ Content hash of every input that shapes the completion """
+    payload = json.dumps({
+        "model": active_model(),
+        "temperature": OPENAI_TEMPERATURE,
+        "max_tokens": max_tokens or active_max_tokens(),
+        "system": SYSTEM_MESSAGE,
+        "prompt_sha256": hashlib.sha256(prompt.encode('utf-8')).hexdigest(),
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def is_truthy(value):
+    """ Interprets form/JSON/query flags such as "1", "true" or "on" """
+    return str(value if value is not None else '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def wants_cache_bypass(req, company_details):
+    """ A request can force fresh output with `Cache-Control: no-cache` or a
+    truthy `bypass_cache` field """
+    if 'no-cache' in req.headers.get('Cache-Control', '').lower():
+        return True
+    return is_truthy(company_details.get('bypass_cache'))
+
+
+# --- Metrics ---
+# Per-stage timings, token usage and PDF sizes, aggregated per process and
+# exposed in Prometheus text format at /metrics. Each request also gets a
+# RequestTrace with its own breakdown, logged when the request is slow.
+
+class Histogram:
+    """ Minimal labelled Prometheus histogram """
+
+    def __init__(self, name, description, buckets, label_name=None):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.label_name = label_name
+        self._series = {}  # label value -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, label=None):
+        with self._lock:
+            series = self._series.setdefault(label, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label, series in sorted(self._series.items(), key=lambda item: str(item[0])):
+                prefix = f'{self.label_name}="{label}",' if self.label_name else ''
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-2]}')
+                suffix = f'{{{prefix[:-1]}}}' if prefix else ''
+                lines.append(f"{self.name}_count{suffix} {series[-2]}")
+                lines.append(f"{self.name}_sum{suffix} {series[-1]}")
+        return lines
+
+
+class Counter:
+    """ Minimal Prometheus counter with label sets given as dicts """
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                labels = ",".join(f'{name}="{label}"' for name, label in key)
+                lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+STAGE_SECONDS = Histogram("blueprint_stage_seconds", "Time spent per request stage.",
+                          LATENCY_BUCKETS, label_name="stage")
+REQUEST_SECONDS = Histogram("blueprint_request_seconds", "End-to-end request time by endpoint.",
+                            LATENCY_BUCKETS, label_name="endpoint")
+PDF_BYTES = Histogram("blueprint_pdf_bytes", "Size of generated PDFs.",
+                      (5e3, 1e4, 2.5e4, 5e4, 1e5, 2.5e5, 5e5, 1e6))
+TOKENS_TOTAL = Counter("blueprint_tokens_total", "OpenAI tokens used, by kind.")
+REQUESTS_TOTAL = Counter("blueprint_requests_total", "Requests by endpoint and status code.")
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class RequestTrace:
+    """ Stage timings and usage for one request (or background job) """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.tokens = {}
+        self.pdf_bytes = None
+        self.route = None
+
+    def breakdown(self, total=None):
+        return {
+            "request": self.name,
+            "total_seconds": round(total if total is not None else time.perf_counter() - self.started, 4),
+            "stages": {stage: round(seconds, 4) for stage, seconds in self.spans.items()},
+            "tokens": self.tokens,
+            "pdf_bytes": self.pdf_bytes,
+            "route": self.route,
+        }
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.spans[stage] = trace.spans.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed_stage(stage):
+    """ Times the enclosed block as one request stage """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def record_usage(usage):
+    """ Adds an API usage object to the token counters and the current trace """
+    details = getattr(usage, 'prompt_tokens_details', None)
+    counts = {
+        "prompt": usage.prompt_tokens or 0,
+        "completion": usage.completion_tokens or 0,
+        "cached": getattr(details, 'cached_tokens', None) or 0,
+    }
+    trace = current_trace.get()
+    for kind, count in counts.items():
+        TOKENS_TOTAL.inc(count, kind=kind)
+        if trace is not None:
+            trace.tokens[kind] = trace.tokens.get(kind, 0) + count
+
+
+def record_pdf_size(size):
+    PDF_BYTES.observe(size)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.pdf_bytes = size
+
+
+def finish_trace(trace, total_seconds):
+    """ Logs the stage breakdown of requests slower than BLUEPRINT_SLOW_REQUEST_SECONDS """
+    if BLUEPRINT_SLOW_REQUEST_SECONDS > 0 and total_seconds >= BLUEPRINT_SLOW_REQUEST_SECONDS:
+        print(f"Slow request: {json.dumps(trace.breakdown(total_seconds))}")
+
+
+def render_metrics():
+    """ All metrics in Prometheus text exposition format """
+    lines = []
+    for metric in (STAGE_SECONDS, REQUEST_SECONDS, PDF_BYTES, TOKENS_TOTAL, REQUESTS_TOTAL, OPENAI_EVENTS_TOTAL,
+                   COALESCED_TOTAL, ADMISSION_TOTAL, ROUTES_TOTAL, SECTION_REPAIRS_TOTAL):
+        lines.extend(metric.render())
+    lines += ["# HELP blueprint_generations_in_flight Admitted generations running now.",
+              "# TYPE blueprint_generations_in_flight gauge",
+              f"blueprint_generations_in_flight {admission_queue.in_flight}",
+              "# HELP blueprint_admission_queue_depth Generations waiting for a slot.",
+              "# TYPE blueprint_admission_queue_depth gauge",
+              f"blueprint_admission_queue_depth {admission_queue.depth()}"]
+    for name, cache, label in (("blueprint_cache", blueprint_cache, "Blueprint"),
+                               ("blueprint_section_cache", section_cache, "Section")):
+        stats = cache.snapshot()
+        lines += [f"# HELP {name}_events_total {label} cache lookups and stores.",
+                  f"# TYPE {name}_events_total counter"]
+        for event in ("memory_hits", "disk_hits", "misses", "bypassed", "stores"):
+            lines.append(f'{name}_events_total{{event="{event}"}} {stats[event]}')
+    return "\n".join(lines) + "\n"
+
+
+def start_request_trace():
+    g.trace = RequestTrace(request.endpoint or request.path)
+    current_trace.set(g.trace)
+
+
+def record_request_metrics(response):
+    trace = g.get('trace')
+    if trace is None or request.endpoint in ('metrics_endpoint', 'healthz_endpoint', None):
+        return response
+    REQUESTS_TOTAL.inc(endpoint=request.endpoint, status=response.status_code)
+    # Picked up by finish_request_trace once the body has been sent
+    request.environ['blueprint.trace'] = trace
+    request.environ['blueprint.handled_at'] = time.perf_counter()
+    return response
+
+
+def finish_request_trace(environ):
+    trace = environ.get('blueprint.trace')
+    if trace is None:
+        return
+    now = time.perf_counter()
+    STAGE_SECONDS.observe(now - environ['blueprint.handled_at'], 'send')
+    trace.spans['send'] = now - environ['blueprint.handled_at']
+    REQUEST_SECONDS.observe(now - trace.started, trace.name)
+    finish_trace(trace, now - trace.started)
+
+
+def instrument_wsgi(wsgi_app):
+    """ Wraps the WSGI app so the 'send' stage ends when the server closes
+    the response body (after_request callbacks run before it is sent, and
+    call_on_close is skipped for send_file responses) """
+    def instrumented_app(environ, start_response):
+        return ClosingIterator(wsgi_app(environ, start_response), lambda: finish_request_trace(environ))
+    return instrumented_app
+
+
+
+# --- OpenAI Transport ---
+# Every completion goes through create_completion / open_completion_stream:
+# exponential backoff with jitter for transient failures, capped by a
+# process-wide retry budget so an upstream incident cannot multiply our
+# traffic, and optional hedging of calls whose first token is late.
+
+def retryable_errors():
+    """ Transient OpenAI errors (the SDK is already loaded once a call has failed) """
+    from openai import APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+    return (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
+
+OPENAI_EVENTS_TOTAL = Counter("blueprint_openai_events_total", "Retries and hedges of OpenAI calls.")
+
+
+class RetryBudget:
+    """ Token bucket shared by all calls: every first attempt deposits
+    `ratio` tokens, every retry or hedge withdraws one. Retries therefore
+    add at most ~ratio extra load on top of normal traffic. """
+
+    def __init__(self, ratio, max_tokens):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = float(max_tokens)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class LatencyWindow:
+    """ Rolling window of recent time-to-first-token samples """
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+retry_budget = RetryBudget(OPENAI_RETRY_BUDGET_RATIO, OPENAI_RETRY_BUDGET_MAX)
+first_token_latency = LatencyWindow()
+
+
+def with_retries(call):
+    """ Runs call() and retries transient OpenAI errors with backoff while the budget allows """
+    retry_budget.deposit()
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        try:
+            return call()
+        except retryable_errors() as e:
+            if attempt >= OPENAI_MAX_RETRIES:
+                raise
+            if not retry_budget.withdraw():
+                OPENAI_EVENTS_TOTAL.inc(event="retry_budget_exhausted")
+                raise
+            delay = random.uniform(0, min(OPENAI_RETRY_MAX_DELAY, OPENAI_RETRY_BASE_DELAY * 2 ** attempt))
+            OPENAI_EVENTS_TOTAL.inc(event="retry")
+            print(f"OpenAI call failed ({type(e).__name__}), retrying in {delay:.2f}s...")
+            time.sleep(delay)
+
+
+def _start_stream(params):
+    """ Opens a streamed completion and waits for its first chunk.
+    Returns (stream, chunk_iterator, first_chunk). """
+    started = time.perf_counter()
+    stream = get_client().chat.completions.create(stream=True, stream_options={"include_usage": True}, **params)
+    chunks = iter(stream)
+    try:
+        first_chunk = next(chunks)
+    except StopIteration:
+        first_chunk = None
+    first_token_latency.add(time.perf_counter() - started)
+    return stream, chunks, first_chunk
+
+
+def _close_stream(stream):
+    try:
+        stream.close()
+    except Exception:
+        pass
+
+
+def hedge_deadline():
+    """ Seconds to wait for a first token before hedging, or None """
+    if not OPENAI_HEDGE:
+        return None
+    deadline = first_token_latency.percentile(OPENAI_HEDGE_PERCENTILE, OPENAI_HEDGE_MIN_SAMPLES)
+    return None if deadline is None else max(deadline, OPENAI_HEDGE_MIN_DELAY)
+
+
+def open_completion_stream(**params):
+    """ Opens a streamed completion and returns an iterator over its chunks.
+    With OPENAI_HEDGE on, a second identical call is fired when the first
+    token is later than the recent OPENAI_HEDGE_PERCENTILE; whichever
+    answers first is used and the other is closed. The hedge is a single
+    attempt, and none is sent once the first call has failed (it is then
+    backing off to retry, not slow). """
+    deadline = hedge_deadline()
+    if deadline is None:
+        stream, chunks, first_chunk = with_retries(lambda: _start_stream(params))
+        return itertools.chain([first_chunk] if first_chunk is not None else [], chunks)
+
+    results = queue.Queue()
+    state = {"winner": None, "primary_failed": False}
+    state_lock = threading.Lock()
+
+    def start_primary():
+        try:
+            return _start_stream(params)
+        except Exception:
+            state["primary_failed"] = True
+            raise
+
+    def attempt(name, start):
+        try:
+            opened = start()
+        except Exception as e:
+            results.put((name, None, e))
+            return
+        with state_lock:
+            lost = state["winner"] is not None
+            if not lost:
+                state["winner"] = name
+        if lost:
+            # Cancel the loser: closing the stream drops the HTTP response
+            _close_stream(opened[0])
+            return
+        results.put((name, opened, None))
+
+    threading.Thread(target=attempt, args=("primary", lambda: with_retries(start_primary)), daemon=True).start()
+    attempts = 1
+    try:
+        name, opened, error = results.get(timeout=deadline)
+    except queue.Empty:
+        if not state["primary_failed"] and retry_budget.withdraw():
+            OPENAI_EVENTS_TOTAL.inc(event="hedge")
+            print(f"No first token after {deadline:.2f}s, sending a hedged request.")
+            threading.Thread(target=attempt, args=("hedge", lambda: _start_stream(params)), daemon=True).start()
+            attempts = 2
+        name, opened, error = results.get()
+
+    while opened is None and attempts > 1:
+        # The first attempt to finish failed; wait for the other one
+        attempts -= 1
+        name, opened, error = results.get()
+    if opened is None:
+        raise error
+    if name == "hedge":
+        OPENAI_EVENTS_TOTAL.inc(event="hedge_won")
+    stream, chunks, first_chunk = opened
+    return itertools.chain([first_chunk] if first_chunk is not None else [], chunks)
+
+
+def create_completion(**params):
+    """ Non-streamed completion through the tuned transport. With hedging on
+    the call is streamed underneath and reassembled into the same shape
+    (choices[0].message.content, choices[0].finish_reason, usage). """
+    if not OPENAI_HEDGE:
+        return with_retries(lambda: get_client().chat.completions.create(**params))
+
+    parts = []
+    finish_reason = None
+    usage = None
+    for chunk in open_completion_stream(**params):
+        if getattr(chunk, 'usage', None):
+            usage = chunk.usage
+        if chunk.choices:
+            choice = chunk.choices[0]
+            if choice.delta and choice.delta.content:
+                parts.append(choice.delta.content)
+            finish_reason = choice.finish_reason or finish_reason
+    message = SimpleNamespace(role="assistant", content="".join(parts))
+    return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message, finish_reason=finish_reason)],
+                           usage=usage)
+
+
+# --- Request Coalescing ---
+# Identical generations that overlap in time share one in-flight call:
+# the first caller (leader) does the work and every concurrent caller with
+# the same key waits for its result, errors included. A leader that goes
+# away without a result (a streaming client that disconnects) abandons the
+# call instead, and its waiters join again: the first one takes over.
+# Within a process this is a single-flight map; across workers an optional
+# SQLite lease makes other processes wait for the leader and then read its
+# result from the shared cache tier.
+
+class CoalesceTimeout(TimeoutError):
+    pass
+
+
+class CoalesceAbandoned(Exception):
+    """ The leader stopped before producing a result """
+
+
+class SingleFlight:
+    """ Deduplicates concurrent calls with the same key """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """ Returns (call, leader). The leader must finish() the call; the
+        others wait() for it. """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"event": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+        if not leader:
+            COALESCED_TOTAL.inc(kind=self.name)
+        return call, leader
+
+    def wait(self, call, timeout):
+        if not call["event"].wait(timeout):
+            raise CoalesceTimeout(f"Timed out after {timeout:.0f}s waiting for an identical in-flight {self.name}.")
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+
+    def finish(self, key, call, result=None, error=None):
+        call["result"], call["error"] = result, error
+        with self._lock:
+            del self._calls[key]
+        call["event"].set()
+
+    def abandon(self, key, call):
+        """ Ends the call without a result; its waiters join again """
+        self.finish(key, call, error=CoalesceAbandoned(f"The identical in-flight {self.name} was abandoned."))
+
+    def run(self, key, func, timeout):
+        while True:
+            call, leader = self.join(key)
+            if leader:
+                break
+            try:
+                return self.wait(call, timeout)
+            except CoalesceAbandoned:
+                continue
+
+        result, error = None, None
+        try:
+            result = func()
+            return result
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.finish(key, call, result, error)
+
+
+class SQLiteLease:
+    """ Cross-process lease: one row per key, expiring after `ttl` seconds
+    so a crashed leader cannot block followers forever """
+
+    def __init__(self, db_path, ttl):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS leases ("
+                         "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+
+    def acquire(self, key):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM leases WHERE key = ? AND expires_at < ?", (key, now))
+                inserted = conn.execute("INSERT OR IGNORE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                                        (key, self.owner, now + self.ttl)).rowcount
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        return inserted == 1
+
+    def release(self, key):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner))
+
+
+COALESCED_TOTAL = Counter("blueprint_coalesced_total", "Requests that joined an identical in-flight call.")
+
+generation_flights = SingleFlight("generation")
+pdf_flights = SingleFlight("pdf")
+generation_lease = None
+if BLUEPRINT_COALESCE_LEASE_DB:
+    try:
+        generation_lease = SQLiteLease(BLUEPRINT_COALESCE_LEASE_DB, BLUEPRINT_COALESCE_WAIT + 30)
+    except sqlite3.Error as e:
+        print(f"Warning: Cross-worker request coalescing disabled ({e})")
+
+
+def generation_flight_key(company_details, mode):
+    normalized = normalize_company_details(company_details)
+    normalized['generation_mode'] = mode
+    normalized['route'] = [active_model(), active_max_tokens()]
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def run_with_lease(key, func, timeout):
+    """ Waits until no other worker holds the lease for `key`, then runs func under it """
+    deadline = time.time() + timeout
+    try:
+        while not generation_lease.acquire(key):
+            if time.time() >= deadline:
+                raise CoalesceTimeout(f"Timed out after {timeout:.0f}s waiting for an identical generation in another worker.")
+            time.sleep(0.5)
+    except sqlite3.Error as e:
+        print(f"Warning: Coalescing lease unavailable ({e}), generating without it")
+        return func()
+    try:
+        return func()
+    finally:
+        try:
+            generation_lease.release(key)
+        except sqlite3.Error as e:
+            print(f"Warning: Failed to release coalescing lease: {e}")
+
+
+# --- Admission Control ---
+# Generation requests pass a per-client token bucket, then wait for one of
+# BLUEPRINT_MAX_IN_FLIGHT slots in a bounded FIFO queue; a full queue or a
+# wait longer than BLUEPRINT_QUEUE_TIMEOUT is answered with 429 and
+# Retry-After. Admitted requests are routed: while the queue is deep or the
+# recent p90 generation time is over BLUEPRINT_LATENCY_SLO they use the
+# degraded route (OPENAI_FAST_MODEL, BLUEPRINT_DEGRADED_MAX_TOKENS).
+
+ADMISSION_TOTAL = Counter("blueprint_admission_total", "Admission decisions for generation requests.")
+ROUTES_TOTAL = Counter("blueprint_routes_total", "Admitted generations by route.")
+
+current_route = contextvars.ContextVar('current_route', default=None)
+
+
+class TokenBucketLimiter:
+    """ One token bucket per client key: `rate` tokens per second, at most `burst` saved up """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """ Returns (allowed, seconds_until_a_token) """
+        if self.rate <= 0:
+            return True, 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / self.rate
+
+
+class AdmissionQueue:
+    """ At most `max_in_flight` admitted generations and `max_queue` waiting
+    ones. Threads and coroutines wait in the same FIFO; a released slot is
+    handed straight to the oldest waiter. """
+
+    def __init__(self, max_in_flight, max_queue):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def depth(self):
+        with self._lock:
+            return len(self._waiters)
+
+    def _enter(self, wake):
+        """ Returns 'admitted', 'queue_full' or a waiter handle (lock held) """
+        if self.in_flight < self.max_in_flight:
+            self.in_flight += 1
+            return 'admitted'
+        if len(self._waiters) >= self.max_queue:
+            return 'queue_full'
+        waiter = [wake]
+        self._waiters.append(waiter)
+        return waiter
+
+    def _give_up(self, waiter):
+        """ 'queue_timeout', or 'admitted' if a slot was handed over meanwhile """
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                return 'queue_timeout'
+        return 'admitted'
+
+    def acquire(self, timeout):
+        event = threading.Event()
+        with self._lock:
+            waiter = self._enter(event.set)
+        if isinstance(waiter, str):
+            return waiter
+        return 'admitted' if event.wait(timeout) else self._give_up(waiter)
+
+    async def acquire_async(self, timeout):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        with self._lock:
+            waiter = self._enter(wake)
+        if isinstance(waiter, str):
+            return waiter
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return 'admitted'
+        except asyncio.TimeoutError:
+            return self._give_up(waiter)
+        except asyncio.CancelledError:
+            # Leave the queue; a slot handed over in the meantime goes to the next waiter
+            if self._give_up(waiter) == 'admitted':
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()  # the slot passes on, in_flight is unchanged
+            else:
+                self.in_flight -= 1
+                return
+        waiter[0]()
+
+
+rate_limiter = TokenBucketLimiter(BLUEPRINT_RATE_LIMIT_PER_MINUTE / 60.0, BLUEPRINT_RATE_LIMIT_BURST)
+admission_queue = AdmissionQueue(BLUEPRINT_MAX_IN_FLIGHT, BLUEPRINT_MAX_QUEUE)
+generation_latency = LatencyWindow()
+
+
+def client_identity(req):
+    """ Rate limit key: the client address. X-Forwarded-For is only trusted
+    as far as BLUEPRINT_PROXY_HOPS (WSGI) or FORWARDED_ALLOW_IPS (ASGI)
+    allow, and then already resolved into remote_addr. """
+    return req.remote_addr or 'unknown'
+
+
+def choose_route(queue_depth):
+    """ Model and completion budget for the next generation, with the reason """
+    if queue_depth >= BLUEPRINT_DEGRADE_QUEUE_DEPTH:
+        reason = f"queue_depth={queue_depth}"
+    else:
+        p90 = generation_latency.percentile(90, BLUEPRINT_LATENCY_MIN_SAMPLES)
+        if p90 is None or p90 <= BLUEPRINT_LATENCY_SLO:
+            return SimpleNamespace(name='default', model=OPENAI_MODEL, max_tokens=OPENAI_MAX_TOKENS, reason='normal')
+        reason = f"p90={p90:.1f}s>slo={BLUEPRINT_LATENCY_SLO:.0f}s"
+    return SimpleNamespace(name='degraded', model=OPENAI_FAST_MODEL or OPENAI_MODEL,
+                           max_tokens=BLUEPRINT_DEGRADED_MAX_TOKENS, reason=reason)
+
+
+def active_model():
+    route = current_route.get()
+    return route.model if route is not None else OPENAI_MODEL
+
+
+def active_max_tokens():
+    route = current_route.get()
+    return route.max_tokens if route is not None else OPENAI_MAX_TOKENS
+
+
+def too_many_requests(message, retry_after):
+    response = jsonify({"error": message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+    return response
+
+
+def check_rate_limit(req):
+    """ None, or the 429 response for a client over its rate limit """
+    allowed, retry_after = rate_limiter.acquire(client_identity(req))
+    if allowed:
+        return None
+    ADMISSION_TOTAL.inc(outcome='rate_limited')
+    print(f"Rate limited {client_identity(req)}, retry in {retry_after:.1f}s")
+    return too_many_requests("Too many blueprint requests, please retry later.", retry_after)
+
+
+def queue_retry_after():
+    """ Rough wait for a slot: the queue ahead drains max_in_flight at a time """
+    typical = generation_latency.percentile(50, 1) or BLUEPRINT_LATENCY_SLO
+    return min(120, typical * (admission_queue.depth() + 1) / max(1, BLUEPRINT_MAX_IN_FLIGHT))
+
+
+def start_generation(outcome, waited, bind_route=True):
+    """ Returns (ticket, None) for an admitted request, else (None, 429 response) """
+    ADMISSION_TOTAL.inc(outcome=outcome)
+    if outcome != 'admitted':
+        print(f"Admission rejected ({outcome}) after {waited:.2f}s, {admission_queue.depth()} waiting")
+        message = ("Blueprint queue is full, please retry shortly." if outcome == 'queue_full'
+                   else "Timed out waiting for a free generation slot, please retry shortly.")
+        return None, too_many_requests(message, queue_retry_after())
+    return open_ticket(waited, bind_route), None
+
+
+def open_ticket(waited, bind_route=True):
+    """ Routes an admitted generation. With bind_route the route is set for
+    the calling context; otherwise whoever runs the generation sets
+    current_route to ticket.route itself. """
+    route = choose_route(admission_queue.depth())
+    ROUTES_TOTAL.inc(route=route.name)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.route = f"{route.name}:{route.model}:{route.max_tokens}"
+    print(f"Routing: route={route.name} model={route.model} max_tokens={route.max_tokens} "
+          f"reason={route.reason} queue_wait={waited:.2f}s")
+    return SimpleNamespace(route=route, waited=waited, started=time.perf_counter(),
+                           token=current_route.set(route) if bind_route else None)
+
+
+def admit_generation(bind_route=True):
+    """ Waits for a generation slot on the calling thread """
+    started = time.perf_counter()
+    outcome = admission_queue.acquire(BLUEPRINT_QUEUE_TIMEOUT)
+    return start_generation(outcome, time.perf_counter() - started, bind_route)
+
+
+async def admit_generation_async():
+    started = time.perf_counter()
+    outcome = await admission_queue.acquire_async(BLUEPRINT_QUEUE_TIMEOUT)
+    return start_generation(outcome, time.perf_counter() - started)
+
+
+def finish_generation(ticket):
+    """ Frees the slot and feeds the latency window the routing policy watches """
+    generation_latency.add(time.perf_counter() - ticket.started)
+    if ticket.token is not None:
+        current_route.reset(ticket.token)
+    admission_queue.release()
+
+
+def add_route_headers(response, ticket):
+    response = make_response(response)
+    response.headers['X-Blueprint-Route'] = ticket.route.name
+    response.headers['X-Blueprint-Model'] = ticket.route.model
+    response.headers['X-Blueprint-Max-Tokens'] = str(ticket.route.max_tokens)
+    response.headers['X-Blueprint-Route-Reason'] = ticket.route.reason
+    response.headers['X-Blueprint-Queue-Wait'] = f"{ticket.waited:.3f}"
+    return response
+
+
+# --- Helper Functions ---
+
+def build_blueprint_prompt(company_details):
+    """ Builds the user prompt: the precompiled static prefix for the selected
+    SOPs followed by the client details """
+    catalog = get_sop_catalog()
+    return catalog.prompt_prefix(blueprint_sops(company_details, catalog)) + BLUEPRINT_PROMPT_SUFFIX.format(
+        company_name=company_details.get('company_name') or 'N/A',
+        product_service=company_details.get('product_service') or 'N/A',
+        target_audience=company_details.get('target_audience') or 'N/A',
+        business_goal=company_details.get('business_goal') or 'N/A',
+        website=company_details.get('website') or 'N/A',
+        current_marketing=company_details.get('current_marketing') or 'N/A',
+    )
+
+
+def blueprint_max_tokens(company_details):
+    """ Completion budget for a whole blueprint: the route's budget, cut in
+    proportion when only some SOPs are selected (the concluding remarks
+    count as one more section) """
+    catalog = get_sop_catalog()
+    budget = active_max_tokens()
+    selected = len(blueprint_sops(company_details, catalog))
+    total = len(catalog.registry)
+    if selected >= total:
+        return budget
+    return min(budget, max(BLUEPRINT_SECTION_MAX_TOKENS, math.ceil(budget * (selected + 1) / (total + 1))))
+
+
+def log_usage(usage, label="Blueprint"):
+    """ Logs token usage, including the prompt tokens served from the provider's prefix cache """
+    if usage is None:
+        return
+    record_usage(usage)
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = getattr(details, 'cached_tokens', None) or 0
+    print(f"{label} usage: prompt_tokens={usage.prompt_tokens} cached_tokens={cached_tokens} "
+          f"completion_tokens={usage.completion_tokens}")
+
+
+CONCLUDING_SECTION_TITLE = "Concluding Remarks"
+CONCLUDING_SECTION_OBJECTIVE = "A brief summary statement about the holistic approach and focus on achieving the client's key business goal through measurable results and ROI."
+
+# Company fields each section is written from (the 'fields' of an SOP in
+# the catalog). A section prompt only shows these, so an edit to any other
+# field leaves its section cache key (and text) unchanged. SOPs without
+# 'fields' depend on every field.
+CONCLUDING_SECTION_FIELDS = ['company_name', 'product_service', 'business_goal']
+
+COMPANY_FIELD_LABELS = {
+    'company_name': "Company Name",
+    'product_service': "Product/Service",
+    'target_audience': "Target Audience (Brief)",
+    'business_goal': "Key Business Goal",
+    'website': "Website (Optional)",
+    'current_marketing': "Current Marketing Efforts (Brief)",
 }
 
 
-# --- Helper Functions ---
+def section_fields(title):
+    if title == CONCLUDING_SECTION_TITLE:
+        return CONCLUDING_SECTION_FIELDS
+    return get_sop_catalog().field_dependencies.get(title, COMPANY_FIELDS)
+
+
+def blueprint_sections(company_details=None):
+    """ Section title -> objective, in blueprint order: the SOPs selected by
+    company_details (all of them without it), then the concluding remarks """
+    catalog = get_sop_catalog()
+    titles = blueprint_sops(company_details, catalog) if company_details is not None else catalog.registry
+    sections = OrderedDict((title, catalog.registry[title]['objective']) for title in titles)
+    sections[CONCLUDING_SECTION_TITLE] = CONCLUDING_SECTION_OBJECTIVE
+    return sections
+
+
+def build_section_prompt(company_details, title, objective):
+    """ Builds the user prompt for a single SOP section, showing only the
+    company fields the section depends on """
+    company_name = company_details.get('company_name') or 'The Client'
+    client_details = "\n".join(f"    - {COMPANY_FIELD_LABELS[field]}: {company_details.get(field) or 'N/A'}"
+                               for field in section_fields(title))
+    return f"""
+    Act as a professional Performance Marketing Consultant specializing in EdTech.
+    You are writing ONE section of a customized Performance Marketing Blueprint for a potential client.
+    The goal is to convince the client to purchase these performance marketing services.
+
+    Client Company Details:
+{client_details}
+
+    Section: {title}
+    Objective: {objective}
+
+    Do not just list a checklist. Briefly explain HOW this phase will be specifically approached and tailored for {company_name}, considering their product, audience, and goals. Highlight the importance and expected outcome of this phase for their specific business. Maintain a professional, confident, and action-oriented tone.
+
+    Generate ONLY the body text of this section, without repeating the section heading.
+    """
+
+
+section_executor = ThreadPoolExecutor(max_workers=BLUEPRINT_SECTION_CONCURRENCY, thread_name_prefix="blueprint-section")
+
+
+def generate_ai_section(prompt, model=None):
+    """ Runs one section completion; raises on failure so the caller can retry it """
+    start = time.perf_counter()
+    response = create_completion(
+        model=model or OPENAI_MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=OPENAI_TEMPERATURE,
+        max_tokens=BLUEPRINT_SECTION_MAX_TOKENS
+    )
+    # Runs on a pool thread: only the histogram sees this, the request trace gets the fan-out total
+    STAGE_SECONDS.observe(time.perf_counter() - start, 'section_completion')
+    log_usage(getattr(response, 'usage', None), "Section")
+    if not response.choices or not response.choices[0].message.content:
+        raise ValueError("OpenAI response structure unexpected or empty.")
+    return response.choices[0].message.content.strip()
+
+
+def generate_ai_blueprint_parallel(company_details, use_cache=True):
+    """ Generates every SOP section as its own completion on the shared
+    section pool and assembles the result in catalog order """
+    with timed_stage('prompt_build'):
+        normalized = normalize_company_details(company_details)
+        prompts = section_prompts(normalized)
+        cache_key = blueprint_cache_key("parallel\n" + "\n".join(prompts.values()),
+                                        max_tokens=BLUEPRINT_SECTION_MAX_TOKENS)
+
+    if use_cache:
+        cached_text = blueprint_cache.get(cache_key)
+        if cached_text is not None:
+            print(f"Blueprint cache hit ({cache_key[:12]}).")
+            return cached_text
+    else:
+        blueprint_cache.record_bypass()
+
+    blueprint_text = generate_blueprint_sections(normalized, use_cache=use_cache)
+    if not blueprint_text.startswith("Error:"):
+        blueprint_cache.put(cache_key, blueprint_text)
+    return blueprint_text
+
+
+def section_cache_key(prompt):
+    return blueprint_cache_key("section\n" + prompt, max_tokens=BLUEPRINT_SECTION_MAX_TOKENS)
+
+
+def section_prompts(company_details):
+    """ Section title -> prompt for the given (normalized) details """
+    return OrderedDict((title, build_section_prompt(company_details, title, objective))
+                       for title, objective in blueprint_sections(company_details).items())
+
+
+def cached_sections(company_details):
+    """ Section title -> cached text for every section whose dependent fields
+    match an earlier generation """
+    cached = OrderedDict()
+    for title, prompt in section_prompts(normalize_company_details(company_details)).items():
+        section_text = section_cache.get(section_cache_key(prompt))
+        if section_text is not None:
+            cached[title] = section_text
+    return cached
+
+
+def generate_blueprint_sections(company_details, use_cache=True, cached=None):
+    """ Assembles the blueprint section by section: sections whose prompt
+    (i.e. whose dependent fields) is unchanged come from the section cache
+    (or `cached`, when the caller already looked them up), the rest are
+    generated in parallel with retries of the sections that fail """
+    with timed_stage('prompt_build'):
+        prompts = section_prompts(normalize_company_details(company_details))
+
+    if cached is None:
+        cached = cached_sections(company_details) if use_cache else {}
+    results = dict(cached)
+    if results:
+        print(f"Reusing {len(results)} of {len(prompts)} cached section(s).")
+
+    pending = [title for title in prompts if title not in results]
+    errors = {}
+    model = active_model()  # the pool threads do not see the request's route
+    fan_out_started = time.perf_counter()
+    for attempt in range(BLUEPRINT_SECTION_RETRIES + 1):
+        if not pending:
+            break
+        if attempt:
+            print(f"Retrying {len(pending)} failed section(s), attempt {attempt + 1}...")
+            time.sleep(min(2 ** (attempt - 1), 8))
+        futures = {title: section_executor.submit(generate_ai_section, prompts[title], model) for title in pending}
+        pending = []
+        for title, future in futures.items():
+            try:
+                results[title] = future.result()
+                section_cache.put(section_cache_key(prompts[title]), results[title])
+            except Exception as e:
+                print(f"Error generating section '{title}': {e}")
+                errors[title] = str(e)
+                pending.append(title)
+    observe_stage('completion', time.perf_counter() - fan_out_started)
+
+    if pending:
+        details = "; ".join(f"{title}: {errors[title]}" for title in pending)
+        return f"Error: Failed to generate blueprint using AI. Details: {details}"
+
+    return "\n\n".join(f"## {title}\n{clean_section_body(results[title], title)}" for title in prompts)
+
+
+def generate_blueprint_section(company_details, title):
+    """ Generates one section afresh (ignoring the section cache) and caches
+    it, without the heading the model tends to echo """
+    normalized = normalize_company_details(company_details)
+    prompt = build_section_prompt(normalized, title, blueprint_sections()[title])
+    with timed_stage('completion'):
+        section_text = clean_section_body(generate_ai_section(prompt, active_model()), title)
+    section_cache.put(section_cache_key(prompt), section_text)
+    return section_text
+
+
+def normalize_heading(text):
+    return re.sub(r'[^a-z0-9]+', ' ', text.lower()).strip()
+
+
+def match_section_title(heading):
+    """ The section title a model-written heading refers to (e.g.
+    '2. Brand Building & Brand Assets'), or None """
+    heading = normalize_heading(heading)
+    for title in blueprint_sections():
+        if normalize_heading(title) in heading:
+            return title
+    return None
+
+
+def split_blueprint_sections(blueprint_text):
+    """ Section title -> body for every recognised '#' heading of a blueprint.
+    A section ends at the next heading of the same or a higher level; text
+    under a heading that names no section (say '## Conclusion') is dropped. """
+    sections = OrderedDict()
+    current = level = None
+    for line in blueprint_text.splitlines():
+        match = MARKDOWN_HEADING.match(line)
+        if match and (current is None or len(match.group(1)) <= level):
+            current, level = match_section_title(match.group(2)), len(match.group(1))
+            if current is not None:
+                sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+    return OrderedDict((title, "\n".join(lines).strip()) for title, lines in sections.items())
+
+
+def cache_blueprint_sections(company_details, blueprint_text):
+    """ Seeds the section cache from a whole-blueprint completion, so a
+    later edit only regenerates the sections it affects """
+    normalized = normalize_company_details(company_details)
+    objectives = blueprint_sections()
+    for title, body in split_blueprint_sections(blueprint_text).items():
+        if body:
+            section_cache.put(section_cache_key(build_section_prompt(normalized, title, objectives[title])), body)
+
+
+def replace_blueprint_section(blueprint_text, title, body):
+    """ Swaps the body of one section, keeping the rest of the text as written.
+    A section the text does not have is appended. """
+    lines = blueprint_text.splitlines()
+    start = end = None
+    for index, line in enumerate(lines):
+        match = MARKDOWN_HEADING.match(line)
+        if not match:
+            continue
+        if start is None and match_section_title(match.group(2)) == title:
+            start = index
+        elif start is not None and len(match.group(1)) <= len(MARKDOWN_HEADING.match(lines[start]).group(1)):
+            end = index
+            break
+    if start is None:
+        return f"{blueprint_text.rstrip()}\n\n## {title}\n{body}"
+    end = len(lines) if end is None else end
+    return "\n".join(lines[:start + 1] + [body, ""] + lines[end:]).rstrip()
+
+
+def generate_ai_blueprint(company_details, use_cache=True, mode=None):
+    """ Generates the blueprint text using OpenAI, serving repeats from the
+    cache and joining an identical generation that is already in flight """
+    mode = mode or company_details.get('generation_mode') or BLUEPRINT_GENERATION_MODE
+    key = generation_flight_key(company_details, mode)
+
+    def generate():
+        if mode == 'parallel':
+            return generate_ai_blueprint_parallel(company_details, use_cache=use_cache)
+        if mode == 'structured':
+            return generate_ai_blueprint_structured(company_details, use_cache=use_cache)
+        return generate_ai_blueprint_single(company_details, use_cache=use_cache)
+
+    def leader():
+        # Across workers, followers wait for the lease and then hit the shared cache
+        if generation_lease is not None:
+            return run_with_lease(key, generate, BLUEPRINT_COALESCE_WAIT)
+        return generate()
+
+    if not use_cache:
+        # A bypass asks for a fresh generation, so it never joins another one
+        return generate()
+    try:
+        return generation_flights.run(key, leader, BLUEPRINT_COALESCE_WAIT)
+    except CoalesceTimeout as e:
+        print(f"Coalescing timeout: {e}")
+        return f"Error: {e}"
+
+
+def generate_ai_blueprint_single(company_details, use_cache=True):
+    """ Generates the whole blueprint in one completion """
+    prompt, cache_key, cached_text = prepare_blueprint_prompt(company_details, use_cache)
+    if cached_text is not None:
+        return cached_text
+
+    cached = cached_sections(company_details) if use_cache else None
+    if cached:
+        # An edit of earlier details: only the sections it affects are regenerated
+        blueprint_text = generate_blueprint_sections(company_details, cached=cached)
+        if not blueprint_text.startswith("Error:"):
+            blueprint_cache.put(cache_key, blueprint_text)
+        return blueprint_text
+
+    try:
+        with timed_stage('completion'):
+            response = create_completion(**blueprint_completion_params(prompt, blueprint_max_tokens(company_details)))
+        blueprint_text = finish_blueprint_response(response, cache_key)
+        if not blueprint_text.startswith("Error:"):
+            cache_blueprint_sections(company_details, blueprint_text)
+        return blueprint_text
+
+    except Exception as e:
+        print(f"Error calling OpenAI API: {e}")
+        # Provide a more informative error message if possible
+        return f"Error: Failed to generate blueprint using AI. Details: {str(e)}"
+
+
+def prepare_blueprint_prompt(company_details, use_cache=True):
+    """ Builds the single-completion prompt and looks it up in the cache.
+    Returns (prompt, cache_key, cached_text_or_None) """
+    with timed_stage('prompt_build'):
+        prompt = build_blueprint_prompt(normalize_company_details(company_details))
+        cache_key = blueprint_cache_key(prompt, blueprint_max_tokens(company_details))
+
+    if use_cache:
+        cached_text = blueprint_cache.get(cache_key)
+        if cached_text is not None:
+            print(f"Blueprint cache hit ({cache_key[:12]}).")
+            return prompt, cache_key, cached_text
+    else:
+        blueprint_cache.record_bypass()
+    return prompt, cache_key, None
+
+
+def blueprint_completion_params(prompt, max_tokens=None):
+    """ Chat completion arguments for a whole-blueprint prompt """
+    return dict(
+        model=active_model(),  # OPENAI_MODEL, or OPENAI_FAST_MODEL under load
+        messages=[
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=OPENAI_TEMPERATURE, # Adjust for creativity vs predictability
+        max_tokens=max_tokens or active_max_tokens()  # see blueprint_max_tokens
+    )
+
+
+def finish_blueprint_response(response, cache_key):
+    """ Extracts and caches the blueprint text of a completion response """
+    log_usage(getattr(response, 'usage', None))
+    # Defensive coding: Check if response structure is as expected
+    if response.choices and len(response.choices) > 0:
+         blueprint_text = response.choices[0].message.content.strip()
+         blueprint_cache.put(cache_key, blueprint_text)
+         return blueprint_text
+    else:
+         print("Warning: OpenAI response structure unexpected or empty.")
+         return "Error: Could not generate blueprint due to unexpected API response."
+
+
+def split_section_chunk(chunk):
+    """ Splits a '## Title\nbody' chunk into (title, body); text before the
+    first heading comes back with an empty title """
+    chunk = chunk.strip()
+    if not chunk.startswith('## '):
+        return '', chunk
+    lines = chunk[3:].split('\n', 1)
+    return lines[0].strip(), (lines[1].strip() if len(lines) > 1 else "")
+
+
+def stored_blueprint_links(company_details, blueprint_text):
+    """ Stores the text of a streamed blueprint (the PDF is rendered on download) """
+    blueprint_id = artifact_store.put(company_details.get('company_name'), blueprint_text,
+                                      company_details=company_details)
+    if blueprint_id is None:
+        return {}
+    return {"blueprint_id": blueprint_id, "pdf_url": f"/blueprints/{blueprint_id}"}
+
+
+def blueprint_text_sections(text):
+    """ Yields (title, body) for each '## ' chunk of a blueprint """
+    for chunk in re.split(r'\n(?=## )', text):
+        title, body = split_section_chunk(chunk)
+        if title or body:
+            yield title, body
+
+
+def section_event(index, title, body):
+    """ Data of a 'section' event: the raw text, and the same HTML the preview page renders """
+    return {"index": index, "title": title, "content": body,
+            "html": str(blueprint_html(parse_blueprint_markdown(body)))}
+
+
+def stream_finished_blueprint(company_details, blueprint_text, cached):
+    for index, (title, body) in enumerate(blueprint_text_sections(blueprint_text)):
+        yield 'section', section_event(index, title, body)
+    yield 'done', dict(stored_blueprint_links(company_details, blueprint_text), cached=cached)
+
+
+def stream_ai_blueprint(company_details, use_cache=True):
+    """ Streams the blueprint as (event, data) pairs: 'delta' for raw tokens,
+    'section' whenever a '## ' section is complete, then 'done' or 'error'.
+    The finished text goes into the blueprint cache and the artifact store;
+    'done' carries the blueprint's pdf_url, which renders the PDF on demand.
+    A stream that overlaps an identical generation (a double submit) waits
+    for it and then streams its sections. """
+    with timed_stage('prompt_build'):
+        prompt = build_blueprint_prompt(normalize_company_details(company_details))
+        cache_key = blueprint_cache_key(prompt, blueprint_max_tokens(company_details))
+
+    if not use_cache:
+        blueprint_cache.record_bypass()
+        yield from stream_blueprint_completion(company_details, prompt, cache_key)
+        return
+
+    cached_text = blueprint_cache.get(cache_key)
+    if cached_text is not None:
+        print(f"Blueprint cache hit ({cache_key[:12]}), streaming cached sections.")
+        yield from stream_finished_blueprint(company_details, cached_text, cached=True)
+        return
+
+    key = generation_flight_key(company_details, 'single')
+    while True:
+        call, leader = generation_flights.join(key)
+        if leader:
+            break
+        try:
+            blueprint_text = generation_flights.wait(call, BLUEPRINT_COALESCE_WAIT)
+        except CoalesceAbandoned:
+            print("Coalesced stream lost its leader, joining again.")
+            continue
+        except Exception as e:
+            print(f"Coalesced stream failed: {e}")
+            blueprint_text = f"Error: {e}"
+        if blueprint_text.startswith("Error:"):
+            yield 'error', {"error": blueprint_text}
+        else:
+            yield from stream_finished_blueprint(company_details, blueprint_text, cached=False)
+        return
+
+    blueprint_text = None
+    try:
+        blueprint_text = yield from stream_blueprint_completion(company_details, prompt, cache_key)
+    finally:
+        # A client that disconnects closes this generator mid-stream
+        if blueprint_text is None:
+            generation_flights.abandon(key, call)
+        else:
+            generation_flights.finish(key, call, result=blueprint_text)
+
+
+def stream_blueprint_completion(company_details, prompt, cache_key):
+    """ Streams one completion (see stream_ai_blueprint) and returns the
+    finished text, or an 'Error:' string """
+    try:
+        started = time.perf_counter()
+        first_token = True
+        stream = open_completion_stream(**blueprint_completion_params(prompt, blueprint_max_tokens(company_details)))
+        parts = []
+        pending = ''
+        index = 0
+        for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                log_usage(chunk.usage, "Streamed blueprint")
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if first_token:
+                observe_stage('time_to_first_token', time.perf_counter() - started)
+                first_token = False
+            parts.append(delta)
+            pending += delta
+            yield 'delta', {"text": delta}
+
+            # Everything before the last heading we have seen is a finished section
+            boundary = pending.rfind('\n## ')
+            if boundary > 0:
+                for title, body in blueprint_text_sections(pending[:boundary]):
+                    yield 'section', section_event(index, title, body)
+                    index += 1
+                pending = pending[boundary + 1:]
+
+        for title, body in blueprint_text_sections(pending):
+            yield 'section', section_event(index, title, body)
+            index += 1
+
+        observe_stage('completion', time.perf_counter() - started)
+        blueprint_text = ''.join(parts).strip()
+        if not blueprint_text:
+            error = "Error: Could not generate blueprint due to unexpected API response."
+            yield 'error', {"error": error}
+            return error
+        blueprint_cache.put(cache_key, blueprint_text)
+        cache_blueprint_sections(company_details, blueprint_text)
+        yield 'done', dict(stored_blueprint_links(company_details, blueprint_text), cached=False)
+        return blueprint_text
+
+    except Exception as e:
+        print(f"Error streaming from OpenAI API: {e}")
+        error = f"Error: Failed to generate blueprint using AI. Details: {str(e)}"
+        yield 'error', {"error": error}
+        return error
+
+
+# --- Structured Output ---
+# generation_mode=structured asks for one JSON object keyed by section title
+# (a strict json_schema response format, so the provider enforces the keys).
+# The reply is checked against the selected sections; the ones that are
+# missing, empty or lost to the token limit (finish_reason == "length") are
+# regenerated one by one through the section path instead of repeating the
+# whole completion. The result is assembled under canonical '## ' headings,
+# so the text splits back into exactly the validated sections.
+
+STRUCTURED_OUTPUT_INSTRUCTIONS = """
+    Respond with a single JSON object and nothing else. Use exactly these keys, in this order:
+{keys}
+    Each value is the Markdown body of that section: paragraphs and '-' bullets, without the section heading.
+    """
+
+# A complete "key": "value" pair, for salvaging a reply that was cut off
+STRUCTURED_PAIR = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:\s*"((?:[^"\\]|\\.)*)"', re.DOTALL)
+
+SECTION_REPAIRS_TOTAL = Counter("blueprint_section_repairs_total",
+                                "Sections regenerated after a structured reply, by reason.")
+
+
+def structured_response_format(titles):
+    return {"type": "json_schema", "json_schema": {
+        "name": "blueprint",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {title: {"type": "string"} for title in titles},
+            "required": list(titles),
+            "additionalProperties": False,
+        },
+    }}
+
+
+def clean_section_body(body, title=None):
+    """ Drops or demotes headings inside a section body that name a section,
+    so they cannot be mistaken for section boundaries later. The first
+    heading naming `title` itself is dropped with any preamble before it. """
+    lines = []
+    echoed = False
+    for line in body.strip().splitlines():
+        match = MARKDOWN_HEADING.fullmatch(line.strip())
+        named = match_section_title(match.group(2)) if match else None
+        if named is not None:
+            if named == title and not echoed:
+                echoed = True
+                lines = []  # e.g. "Here is the section:" before the echoed heading
+            elif lines:
+                lines.append(f"**{match.group(2).strip()}**")
+            continue  # never a section boundary inside a body
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def parse_structured_blueprint(content, titles):
+    """ Section title -> body for every selected, non-empty section of a
+    JSON reply. A reply cut off mid-object still yields the sections that
+    were complete before the cut. """
+    try:
+        data = json.loads(content)
+        pairs = list(data.items()) if isinstance(data, dict) else []
+    except ValueError:
+        pairs = []
+        for key, value in STRUCTURED_PAIR.findall(content):
+            try:
+                pairs.append((json.loads(f'"{key}"'), json.loads(f'"{value}"')))
+            except ValueError:
+                continue
+    sections = {}
+    for key, value in pairs:
+        title = key if key in titles else match_section_title(str(key))
+        if title in titles and isinstance(value, str) and clean_section_body(value, title):
+            sections[title] = clean_section_body(value, title)
+    return sections
+
+
+def generate_ai_blueprint_structured(company_details, use_cache=True):
+    """ Generates the blueprint as JSON keyed by section title and repairs
+    the sections the reply lacks """
+    with timed_stage('prompt_build'):
+        normalized = normalize_company_details(company_details)
+        titles = list(blueprint_sections(normalized))
+        prompt = build_blueprint_prompt(normalized) + STRUCTURED_OUTPUT_INSTRUCTIONS.format(
+            keys="\n".join(f"    - {title}" for title in titles))
+        max_tokens = blueprint_max_tokens(normalized)
+        cache_key = blueprint_cache_key("structured\n" + prompt, max_tokens)
+
+    if use_cache:
+        cached_text = blueprint_cache.get(cache_key)
+        if cached_text is not None:
+            print(f"Blueprint cache hit ({cache_key[:12]}).")
+            return cached_text
+    else:
+        blueprint_cache.record_bypass()
+
+    try:
+        with timed_stage('completion'):
+            response = create_completion(**blueprint_completion_params(prompt, max_tokens),
+                                         response_format=structured_response_format(titles))
+    except Exception as e:
+        print(f"Error calling OpenAI API: {e}")
+        return f"Error: Failed to generate blueprint using AI. Details: {str(e)}"
+
+    log_usage(getattr(response, 'usage', None))
+    choice = response.choices[0] if response.choices else None
+    sections = parse_structured_blueprint((choice.message.content or '') if choice else '', titles)
+    missing = [title for title in titles if title not in sections]
+    if missing:
+        reason = 'truncated' if getattr(choice, 'finish_reason', None) == 'length' else 'missing'
+        SECTION_REPAIRS_TOTAL.inc(len(missing), reason=reason)
+        print(f"Structured reply lacks {len(missing)} of {len(titles)} section(s) ({reason}), "
+              f"regenerating only those.")
+        if use_cache:
+            sections = dict(cached_sections(normalized), **sections)
+
+    blueprint_text = generate_blueprint_sections(normalized, use_cache=use_cache, cached=sections)
+    if not blueprint_text.startswith("Error:"):
+        blueprint_cache.put(cache_key, blueprint_text)
+        cache_blueprint_sections(normalized, blueprint_text)
+    return blueprint_text
+
+
+# --- PDF Rendering ---
+# ReportLab is imported and the styles are built on the first render in each
+# process (or by warm_up). ReportLab layout is
+# pure Python and CPU bound, so renders run in a process pool to keep them
+# off the GIL of the request threads (BLUEPRINT_PDF_PROCESSES=0 renders
+# in-process instead).
+
+def build_pdf_styles():
+    """ The blueprint stylesheet: ReportLab's sample sheet with our tweaks """
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
+
+    styles = getSampleStyleSheet()
+
+    # Custom Styles (Optional)
+    styles['h1'].alignment = TA_CENTER
+    styles['h1'].fontSize = 18
+    styles['h2'].fontSize = 14
+    styles['h2'].spaceBefore = 12
+    styles['h2'].spaceAfter = 6
+    styles['Normal'].alignment = TA_JUSTIFY
+    styles['Normal'].fontSize = 11
+    styles['Normal'].leading = 14 # Line spacing
+    return styles
+
+
+_pdf_styles = None
+
+
+def get_pdf_styles():
+    global _pdf_styles
+    if _pdf_styles is None:
+        _pdf_styles = build_pdf_styles()
+    return _pdf_styles
+
+
+def pdf_page_options():
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+
+    return dict(pagesize=letter,
+                leftMargin=inch, rightMargin=inch,
+                topMargin=inch, bottomMargin=inch)
+
+
+# Markdown subset produced by the model, tokenized line by line in one pass:
+# '#'-'###' headings, '-'/'*'/'•' bullets, '1.'/'1)' numbered items and
+# paragraphs. Blocks are ('heading', level, text), ('paragraph', text),
+# ('bullets', [items]) and ('numbers', start, [items]).
+MARKDOWN_HEADING = re.compile(r'(#{1,3})\s+(.*)')
+MARKDOWN_BULLET = re.compile(r'[-*\u2022]\s+(.*)')
+MARKDOWN_NUMBER = re.compile(r'(\d+)[.)]\s+(.*)')
+MARKDOWN_INLINE = re.compile(r'\*\*(.+?)\*\*|__(.+?)__|\*(?=\S)(.+?)(?<=\S)\*')
+
+
+def parse_blueprint_markdown(text):
+    """ Splits blueprint text into a flat list of blocks """
+    blocks = []
+    paragraph = []
+    list_block = None
+
+    def close_paragraph():
+        if paragraph:
+            blocks.append(('paragraph', '\n'.join(paragraph)))
+            paragraph.clear()
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            close_paragraph()
+            list_block = None
+            continue
+
+        match = MARKDOWN_HEADING.fullmatch(line)
+        if match:
+            close_paragraph()
+            list_block = None
+            blocks.append(('heading', len(match.group(1)), match.group(2).strip().strip('*').strip()))
+            continue
+
+        bullet = MARKDOWN_BULLET.fullmatch(line)
+        number = None if bullet else MARKDOWN_NUMBER.fullmatch(line)
+        if bullet or number:
+            close_paragraph()
+            kind = 'bullets' if bullet else 'numbers'
+            if list_block is None or list_block[0] != kind:
+                list_block = ('bullets', []) if bullet else ('numbers', int(number.group(1)), [])
+                blocks.append(list_block)
+            list_block[-1].append(bullet.group(1) if bullet else number.group(2))
+            continue
+
+        if list_block is not None and raw_line[:1].isspace():
+            # Indented continuation of the previous list item
+            list_block[-1][-1] += ' ' + line
+            continue
+
+        list_block = None
+        paragraph.append(line)
+
+    close_paragraph()
+    return blocks
+
+
+def format_inline_markup(text):
+    """ Escapes text for ReportLab's paragraph parser and converts
+    **bold**/__bold__ and *italic* in a single regex pass. The result is
+    valid HTML too, so the preview uses it as well. """
+    def replace(match):
+        bold = match.group(1) or match.group(2)
+        if bold is not None:
+            return f"<b>{bold}</b>"
+        return f"<i>{match.group(3)}</i>"
+    return MARKDOWN_INLINE.sub(replace, xml_escape(text)).replace('\n', '<br/>')
+
+
+PDF_HEADING_STYLES = {1: 'h1', 2: 'h2', 3: 'h3'}
+
+
+def blueprint_flowables(blocks, styles):
+    """ Turns parsed blocks into many small flowables so ReportLab can lay
+    them out quickly and break pages between blocks """
+    from reportlab.platypus import Paragraph, Spacer, ListFlowable, ListItem
+    from reportlab.lib.units import inch
+
+    story = []
+    seen_heading = False
+    for block in blocks:
+        kind = block[0]
+        if kind == 'heading':
+            level, text = block[1], block[2]
+            if level <= 2:
+                # Add space before new sections except the first one
+                if seen_heading:
+                    story.append(Spacer(1, 0.3*inch))
+                seen_heading = True
+            story.append(Paragraph(format_inline_markup(text), styles[PDF_HEADING_STYLES[level]]))
+            if level <= 2:
+                story.append(Spacer(1, 0.1*inch))
+        elif kind == 'paragraph':
+            story.append(Paragraph(format_inline_markup(block[1]), styles['Normal']))
+            story.append(Spacer(1, 0.08*inch))
+        else:
+            items = [ListItem(Paragraph(format_inline_markup(item), styles['Normal'])) for item in block[-1]]
+            if kind == 'bullets':
+                story.append(ListFlowable(items, bulletType='bullet', start='\u2022', leftIndent=18))
+            else:
+                story.append(ListFlowable(items, bulletType='1', start=block[1], leftIndent=18))
+            story.append(Spacer(1, 0.08*inch))
+    return story
+
+
+def render_pdf_bytes(company_name, blueprint_text):
+    """ Builds the PDF and returns its bytes, or None if ReportLab fails.
+    Module-level so it can run in the PDF process pool. """
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    from reportlab.lib.units import inch
+
+    styles = get_pdf_styles()
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, **pdf_page_options())
+
+    story = []
+    company_name = xml_escape(company_name or '')
+
+    try:
+        # Title
+        story.append(Paragraph(f"Performance Marketing Blueprint", styles['h1']))
+        story.append(Paragraph(f"Prepared for: {company_name}", styles['h1']))
+        story.append(Paragraph(f"Date: {datetime.date.today().strftime('%B %d, %Y')}", styles['Heading3']))
+        story.append(Spacer(1, 0.5*inch))
+
+        # Introduction (Optional - could be generated by AI too)
+        intro_text = f"This document outlines a proposed performance marketing strategy tailored for {company_name}, focusing on achieving your business goals through a data-driven, holistic approach. We will leverage the following phases to build a robust marketing engine:"
+        story.append(Paragraph(intro_text, styles['Normal']))
+        story.append(Spacer(1, 0.2*inch))
+
+        # Process Blueprint Text
+        story.extend(blueprint_flowables(parse_blueprint_markdown(blueprint_text), styles))
+
+        doc.build(story)
+        return buffer.getvalue()
+    except Exception as e:
+        print(f"Error building PDF: {e}")
+        return None
+
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def get_pdf_pool():
+    """ Lazily starts the PDF process pool (None when disabled) """
+    global _pdf_pool
+    if BLUEPRINT_PDF_PROCESSES <= 0:
+        return None
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # spawn: forking a process that already runs request and pool threads is unsafe
+            _pdf_pool = ProcessPoolExecutor(max_workers=BLUEPRINT_PDF_PROCESSES,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+
+def reset_pdf_pool(pool=None, terminate=False):
+    """ Drops `pool` (default: the current one) so the next render starts a
+    fresh one; a pool that was already replaced is left alone. With
+    terminate=True its workers are killed, which is the only way to stop a
+    runaway render (other renders in flight on that pool fail too). """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if pool is None:
+            pool = _pdf_pool
+        if pool is None or pool is not _pdf_pool:
+            return
+        _pdf_pool = None
+    if terminate:
+        if hasattr(pool, 'terminate_workers'):  # Python 3.14+
+            pool.terminate_workers()
+        else:
+            for process in list((pool._processes or {}).values()):
+                process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def create_pdf_blueprint(company_name, blueprint_text, timeout=None):
+    """ Creates the PDF document in memory. Concurrent calls for the same
+    company and text share one render. """
+    key = hashlib.sha256(f"{company_name}\0{blueprint_text}".encode('utf-8')).hexdigest()
+    try:
+        with timed_stage('pdf_build'):
+            pdf_bytes = pdf_flights.run(key, lambda: _render_pdf(company_name, blueprint_text, timeout),
+                                        BLUEPRINT_COALESCE_WAIT)
+    except CoalesceTimeout as e:
+        print(f"Error building PDF: {e}")
+        return None
+    if pdf_bytes is None:
+        # Return None or raise exception to handle it in the route
+        return None
+    record_pdf_size(len(pdf_bytes))
+    return io.BytesIO(pdf_bytes)
+
+
+def _render_pdf(company_name, blueprint_text, timeout, retry=True):
+    pool = get_pdf_pool()
+    if pool is None:
+        return render_pdf_bytes(company_name, blueprint_text)
+
+    timeout = timeout or BLUEPRINT_PDF_TIMEOUT
+    try:
+        future = pool.submit(render_pdf_bytes, company_name, blueprint_text)
+        return future.result(timeout=timeout)
+    except FuturesTimeoutError:
+        print(f"Error building PDF: render timed out after {timeout}s, restarting the pool")
+        if not future.cancel():
+            reset_pdf_pool(pool, terminate=True)
+        return None
+    except (BrokenProcessPool, FuturesCancelledError, RuntimeError) as e:
+        # Usually collateral damage: another render timed out and took the
+        # pool down (broken, shut down, or our pending future cancelled)
+        reset_pdf_pool(pool)
+        if retry:
+            print(f"PDF render lost its process pool ({e!r}), retrying on a fresh one")
+            return _render_pdf(company_name, blueprint_text, timeout, retry=False)
+        print(f"Error building PDF: process pool failed ({e!r})")
+        return None
+
+
+# --- HTML Preview ---
+# Browsers get the blueprint as HTML built from the same parsed blocks as
+# the PDF, which costs a fraction of a ReportLab build. Only the text is
+# stored; the PDF is rendered when the download link is followed.
+
+HTML_HEADING_TAGS = {1: 'h2', 2: 'h3', 3: 'h4'}  # h1 is the page title
+
 
-import re
+def blueprint_html(blocks):
+    """ Turns parsed blocks into an HTML fragment """
+    parts = []
+    for block in blocks:
+        kind = block[0]
+        if kind == 'heading':
+            tag = HTML_HEADING_TAGS[block[1]]
+            parts.append(f"<{tag}>{format_inline_markup(block[2])}</{tag}>")
+        elif kind == 'paragraph':
+            parts.append(f"<p>{format_inline_markup(block[1])}</p>")
+        else:
+            items = ''.join(f"<li>{format_inline_markup(item)}</li>" for item in block[-1])
+            parts.append(f"<ul>{items}</ul>" if kind == 'bullets' else f'<ol start="{block[1]}">{items}</ol>')
+    return Markup('\n'.join(parts))
 
-def format_text_for_reportlab(text):
-    """ Basic formatting conversion for ReportLab Paragraphs """
-    text = text.replace('\n', '<br/>')
-    
-    # Use regex to properly replace paired ** markers with <b> tags
-    text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', text)
-    
-    # Handle bullet points (simple conversion)
-    text = text.replace('- ', '<bullet>&bull;</bullet> ')
-    return text
-
-def generate_ai_blueprint(company_details):
-    """ Generates the blueprint text using OpenAI """
-    prompt = f"""
-    Act as a professional Performance Marketing Consultant specializing in EdTech.
-    You are generating a customized Performance Marketing Blueprint for a potential client.
-    This blueprint should outline the proposed strategy and execution steps, demonstrating clear value and a structured approach based on standard best practices (SOPs).
-    The goal is to convince the client to purchase these performance marketing services.
 
-    Client Company Details:
-    - Company Name: {company_details.get('company_name', 'N/A')}
-    - Product/Service: {company_details.get('product_service', 'N/A')}
-    - Target Audience (Brief): {company_details.get('target_audience', 'N/A')}
-    - Key Business Goal: {company_details.get('business_goal', 'N/A')}
-    - Website (Optional): {company_details.get('website', 'N/A')}
-    - Current Marketing Efforts (Brief): {company_details.get('current_marketing', 'N/A')}
+def render_stored_pdf(blueprint_id, metadata):
+    """ Renders and stores the PDF of a blueprint that was only previewed.
+    Concurrent first downloads share one render. Returns False on failure. """
+    blueprint_text = artifact_store.text(blueprint_id)
+    if blueprint_text is None:
+        return False
+    print(f"Rendering PDF of previewed blueprint {blueprint_id[:12]}...")
+    pdf_buffer = create_pdf_blueprint(metadata['company_name'], blueprint_text)
+    if pdf_buffer is None:
+        return False
+    artifact_store.put_pdf(blueprint_id, pdf_buffer.getvalue())
+    return True
 
-    Based on these details, create a Performance Marketing Blueprint. Structure the blueprint using the following Standard Operating Procedures (SOPs) as sections.
-    For EACH SOP section, do not just list the checklist. Instead, briefly explain HOW this phase will be specifically approached and tailored for THIS client ({company_details.get('company_name', 'The Client')}), considering their product, audience, and goals. Highlight the importance and expected outcome of each phase for their specific business. Maintain a professional, confident, and action-oriented tone.
 
-    Here are the SOPs to structure the blueprint around:
-    --- SOP SECTIONS START ---
-    """
+REQUIRED_FIELDS = ['company_name', 'product_service', 'target_audience', 'business_goal']
 
-    # Append SOP data to the prompt, ensuring the AI knows the structure
-    for title, details in SOP_DATA.items():
-        # Extract objective from details (assumes format "**Objective:** <text>")
-        objective = details.split("**Objective:**")[1].split("**Timeline:**")[0].strip()
-        
-        # Add section to prompt with title and objective
-        prompt += f"\n\n## {title}\nObjective: {objective}\n"
-        prompt += f"(Explain the specific approach and strategy for {company_details.get('company_name')} based on this objective. Consider their product/service, target audience, and goals.)\n"
 
-    prompt += """
-    --- SOP SECTIONS END ---
+def parse_company_details(req):
+    """ Reads company details from a JSON or form request.
+    Returns (company_details, error_message) """
+    if not req.is_json:
+         # Fallback for form data if not JSON
+         if not req.form:
+             return None, "Missing form data or JSON payload"
+         company_details = req.form.to_dict()
+         if len(req.form.getlist('sops')) > 1:
+             company_details['sops'] = req.form.getlist('sops')
+    else:
+        company_details = req.get_json(silent=True)
+        if not isinstance(company_details, dict):
+            return None, "Missing form data or JSON payload"
 
-    Concluding Remarks: End with a brief summary statement about the holistic approach and focus on achieving the client's key business goal through measurable results and ROI.
+    # Basic Validation
+    error = company_details_error(company_details)
+    if error:
+        return None, error
+    return company_details, None
 
-    Generate ONLY the blueprint text, formatted clearly with headings for each SOP section.
-    """
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Or "gpt-3.5-turbo" or other suitable model
-            messages=[
-                {"role": "system", "content": "You are a professional Performance Marketing Consultant specializing in EdTech generating a client blueprint."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7, # Adjust for creativity vs predictability
-            max_tokens=3000  # Adjust based on expected length
-        )
-        # Defensive coding: Check if response structure is as expected
-        if response.choices and len(response.choices) > 0:
-             blueprint_text = response.choices[0].message.content.strip()
-             return blueprint_text
+def validate_company_details(company_details):
+    """ Returns the required fields that are missing or empty """
+    if not isinstance(company_details, dict):
+        return list(REQUIRED_FIELDS)
+    return [field for field in REQUIRED_FIELDS if not company_details.get(field)]
+
+
+def company_details_error(company_details):
+    """ Why a request or batch record cannot be generated, or None """
+    missing = validate_company_details(company_details)
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+    _, error = resolve_sop_selection(company_details)
+    return error
+
+
+def blueprint_filename(company_name):
+    """ Download filename for a client's blueprint PDF """
+    safe_company_name = "".join(c for c in (company_name or 'Client') if c.isalnum() or c in (' ', '_')).rstrip()
+    return f"Performance_Blueprint_{safe_company_name}_{datetime.date.today()}.pdf"
+
+
+# --- Artifact Store ---
+# Every generated blueprint is kept on disk under the SHA-256 of its company
+# name and text, so lost downloads can be fetched again without another
+# completion. The PDF is rendered on the first download when the blueprint
+# was only previewed, and kept with the text after that. Least recently
+# used artifacts are evicted once the store grows past
+# BLUEPRINT_ARTIFACT_MAX_BYTES.
+
+ARTIFACT_ID_PATTERN = re.compile(r'[0-9a-f]{64}')
+ARTIFACT_EXTENSIONS = ('pdf', 'txt', 'json')
+
+
+def write_file_atomic(path, data):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def blueprint_artifact_id(company_name, blueprint_text):
+    return hashlib.sha256(f"{company_name}\0{blueprint_text}".encode('utf-8')).hexdigest()
+
+
+class ArtifactStore:
+    """ Blueprint artifacts as <id>.txt, <id>.json and (once rendered)
+    <id>.pdf files in one directory """
+
+    LOW_WATER = 0.9  # an eviction frees space down to this share of max_bytes
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None  # bytes at the last scan plus what we wrote since; None until scanned
+        self._lock = threading.Lock()
+
+    def path(self, artifact_id, extension):
+        return os.path.join(self.directory, f"{artifact_id}.{extension}")
+
+    def _write(self, artifact_id, extension, data):
+        write_file_atomic(self.path(artifact_id, extension), data)
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+
+    def put(self, company_name, blueprint_text, pdf_bytes=None, company_details=None):
+        """ Stores an artifact and returns its id, or None if it could not be
+        written. Without pdf_bytes only the text is stored and the PDF is
+        rendered on first download. The company details are kept so a
+        section can be regenerated later. """
+        artifact_id = blueprint_artifact_id(company_name, blueprint_text)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if not os.path.exists(self.path(artifact_id, 'json')):
+                metadata = {
+                    "id": artifact_id,
+                    "company_name": company_name,
+                    "filename": blueprint_filename(company_name),
+                    "created_at": time.time(),
+                    "company_details": normalize_company_details(company_details) if company_details else None,
+                }
+                self._write(artifact_id, 'txt', blueprint_text.encode('utf-8'))
+                # The metadata goes last: its presence marks a complete artifact
+                self._write(artifact_id, 'json', json.dumps(metadata).encode('utf-8'))
+        except OSError as e:
+            print(f"Warning: Failed to store blueprint artifact: {e}")
+            return None
+        if pdf_bytes is not None:
+            self.put_pdf(artifact_id, pdf_bytes)
         else:
-             print("Warning: OpenAI response structure unexpected or empty.")
-             return "Error: Could not generate blueprint due to unexpected API response."
+            self.evict()
+        return artifact_id
 
-    except Exception as e:
-        print(f"Error calling OpenAI API: {e}")
-        # Provide a more informative error message if possible
-        return f"Error: Failed to generate blueprint using AI. Details: {str(e)}"
+    def put_pdf(self, artifact_id, pdf_bytes):
+        """ Adds the rendered PDF to a stored artifact """
+        try:
+            if not os.path.exists(self.path(artifact_id, 'pdf')):
+                self._write(artifact_id, 'pdf', pdf_bytes)
+                self.evict()
+        except OSError as e:
+            print(f"Warning: Failed to store blueprint PDF: {e}")
 
+    def metadata(self, artifact_id):
+        """ Metadata of a stored artifact, or None """
+        if not ARTIFACT_ID_PATTERN.fullmatch(artifact_id or ''):
+            return None
+        try:
+            with open(self.path(artifact_id, 'json')) as f:
+                metadata = json.load(f)
+            # The text never changes, so it dates the PDF rendered from it as well
+            metadata["last_modified"] = os.path.getmtime(self.path(artifact_id, 'txt'))
+        except (OSError, ValueError):
+            return None
+        metadata["rendered"] = os.path.exists(self.path(artifact_id, 'pdf'))
+        return metadata
 
-def create_pdf_blueprint(company_name, blueprint_text):
-    """ Creates the PDF document in memory """
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter,
-                            leftMargin=inch, rightMargin=inch,
-                            topMargin=inch, bottomMargin=inch)
-    styles = getSampleStyleSheet()
+    def text(self, artifact_id):
+        try:
+            with open(self.path(artifact_id, 'txt'), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
 
-    # Custom Styles (Optional)
-    styles['h1'].alignment = TA_CENTER
-    styles['h1'].fontSize = 18
-    styles['h2'].fontSize = 14
-    styles['h2'].spaceBefore = 12
-    styles['h2'].spaceAfter = 6
-    styles['Normal'].alignment = TA_JUSTIFY
-    styles['Normal'].fontSize = 11
-    styles['Normal'].leading = 14 # Line spacing
+    def touch(self, artifact_id):
+        """ Marks an artifact as recently used for eviction (atime is unreliable) """
+        try:
+            os.utime(self.path(artifact_id, 'json'))
+        except OSError:
+            pass
 
-    story = []
+    def evict(self):
+        """ Deletes least recently used artifacts once the store is over
+        max_bytes, down to LOW_WATER of it. The directory is only scanned
+        when the running total is over the cap. Each worker counts its own
+        writes between scans, so with several workers the store can briefly
+        run over by what the others wrote since. """
+        with self._lock:
+            if self._size is not None and self._size <= self.max_bytes:
+                return
+            entries = []
+            total = 0
+            try:
+                names = os.listdir(self.directory)
+            except OSError as e:
+                print(f"Warning: Failed to scan the artifact store: {e}")
+                return
+            for name in names:
+                if not name.endswith('.json'):
+                    continue
+                artifact_id = name[:-5]
+                try:
+                    last_used = os.path.getmtime(self.path(artifact_id, 'json'))
+                    size = sum(os.path.getsize(self.path(artifact_id, ext)) for ext in ARTIFACT_EXTENSIONS
+                               if os.path.exists(self.path(artifact_id, ext)))
+                except OSError:
+                    continue
+                entries.append((last_used, artifact_id, size))
+                total += size
+            if total <= self.max_bytes:
+                self._size = total
+                return
+            for last_used, artifact_id, size in sorted(entries):
+                if total <= self.max_bytes * self.LOW_WATER:
+                    break
+                # The metadata goes first, so a half-deleted artifact is never served
+                for ext in ('json', 'pdf', 'txt'):
+                    try:
+                        os.remove(self.path(artifact_id, ext))
+                    except OSError:
+                        pass
+                total -= size
+            self._size = total
+
+
+artifact_store = ArtifactStore(BLUEPRINT_ARTIFACT_DIR, BLUEPRINT_ARTIFACT_MAX_BYTES)
+
+
+# --- Background Jobs ---
+
+class BlueprintJobManager:
+    """ Runs generation + PDF rendering on a bounded thread pool.
+    Jobs are plain dicts guarded by one lock; finished jobs expire after
+    `result_ttl` seconds and at most `max_stored` of them are kept. """
+
+    STAGES = ['queued', 'prompt_sent', 'text_received', 'pdf_built']
+
+    def __init__(self, workers, queue_depth, result_ttl, max_stored):
+        self.queue_depth = queue_depth
+        self.result_ttl = result_ttl
+        self.max_stored = max_stored
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blueprint-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._draining = False
+
+    def submit(self, company_details, use_cache=True):
+        """ Returns (job, error_message) """
+        with self._lock:
+            if self._draining:
+                return None, "Server is shutting down, please retry shortly."
+            self._purge(time.time())
+            active = sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
+            if active >= self.queue_depth:
+                return None, "Blueprint queue is full, please retry shortly."
+            job = {
+                'id': uuid.uuid4().hex,
+                'status': 'queued',
+                'stage': 'queued',
+                'created_at': time.time(),
+                'finished_at': None,
+                'error': None,
+                'pdf': None,
+                'blueprint_id': None,
+                'filename': blueprint_filename(company_details.get('company_name')),
+            }
+            self._jobs[job['id']] = job
+        self._executor.submit(self._run, job, dict(company_details), use_cache)
+        return job, None
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge(time.time())
+            return self._jobs.get(job_id)
 
-    # Title
-    story.append(Paragraph(f"Performance Marketing Blueprint", styles['h1']))
-    story.append(Paragraph(f"Prepared for: {company_name}", styles['h1']))
-    story.append(Paragraph(f"Date: {datetime.date.today().strftime('%B %d, %Y')}", styles['Heading3']))
-    story.append(Spacer(1, 0.5*inch))
-
-    # Introduction (Optional - could be generated by AI too)
-    intro_text = f"This document outlines a proposed performance marketing strategy tailored for {company_name}, focusing on achieving your business goals through a data-driven, holistic approach. We will leverage the following phases to build a robust marketing engine:"
-    story.append(Paragraph(intro_text, styles['Normal']))
-    story.append(Spacer(1, 0.2*inch))
-
-    # Process Blueprint Text
-    # Simple split by heading marker used in the prompt (##)
-    sections = blueprint_text.split('## ')
-    first_section = True
-    for section in sections:
-        if not section.strip():
+    def describe(self, job):
+        with self._lock:
+            return {
+                "job_id": job['id'],
+                "status": job['status'],
+                "stage": job['stage'],
+                "progress": round(self.STAGES.index(job['stage']) / (len(self.STAGES) - 1), 2),
+                "error": job['error'],
+                "created_at": job['created_at'],
+                "finished_at": job['finished_at'],
+                "pdf_url": f"/jobs/{job['id']}/pdf" if job['status'] == 'done' else None,
+                "blueprint_id": job['blueprint_id'],
+            }
+
+    def drain(self, timeout):
+        """ Stops accepting jobs and waits up to `timeout` seconds for the
+        queued and running ones. Returns how many are still unfinished. """
+        deadline = time.time() + timeout
+        with self._lock:
+            self._draining = True
+        while True:
+            with self._lock:
+                active = sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
+            if not active or time.time() >= deadline:
+                return active
+            time.sleep(0.5)
+
+    def _update(self, job, **changes):
+        with self._lock:
+            job.update(changes)
+
+    def _run(self, job, company_details, use_cache):
+        trace = RequestTrace(f"job:{job['id']}")
+        current_trace.set(trace)
+        try:
+            self._update(job, status='running', stage='prompt_sent')
+            blueprint_text = generate_ai_blueprint(company_details, use_cache=use_cache)
+            if blueprint_text.startswith("Error:"):
+                print(f"AI Generation Failed for job {job['id']}: {blueprint_text}")
+                self._update(job, status='failed', error=blueprint_text, finished_at=time.time())
+                return
+            self._update(job, stage='text_received')
+
+            pdf_buffer = create_pdf_blueprint(company_details.get('company_name'), blueprint_text)
+            if pdf_buffer is None:
+                self._update(job, status='failed', error="Failed to generate PDF document.", finished_at=time.time())
+                return
+            pdf_bytes = pdf_buffer.getvalue()
+            blueprint_id = artifact_store.put(company_details.get('company_name'), blueprint_text, pdf_bytes,
+                                              company_details)
+            self._update(job, status='done', stage='pdf_built', pdf=pdf_bytes, blueprint_id=blueprint_id,
+                         finished_at=time.time())
+            print(f"Blueprint job {job['id']} finished.")
+        except Exception as e:
+            print(f"Error running blueprint job {job['id']}: {e}")
+            self._update(job, status='failed', error=f"Error: {str(e)}", finished_at=time.time())
+        finally:
+            finish_trace(trace, time.perf_counter() - trace.started)
+            current_trace.set(None)
+
+    def _purge(self, now):
+        """ Drops expired results, then the oldest finished jobs over the cap (lock held) """
+        finished = [job_id for job_id, job in self._jobs.items() if job['finished_at'] is not None]
+        for job_id in finished:
+            if now - self._jobs[job_id]['finished_at'] > self.result_ttl:
+                del self._jobs[job_id]
+        finished = [job_id for job_id in finished if job_id in self._jobs]
+        for job_id in finished[:max(0, len(finished) - self.max_stored)]:
+            del self._jobs[job_id]
+
+
+blueprint_jobs = BlueprintJobManager(BLUEPRINT_JOB_WORKERS, BLUEPRINT_JOB_QUEUE_DEPTH,
+                                     BLUEPRINT_JOB_RESULT_TTL, BLUEPRINT_JOB_MAX_STORED)
+
+
+# --- Batch Generation ---
+# Bulk runs take a JSONL or CSV file of company records (same fields as the
+# form). Every finished PDF is checkpointed under its record's content hash,
+# so rerunning the same file only generates what is still missing.
+# Checkpoints expire after BLUEPRINT_BATCH_TTL, and a cache bypass ignores
+# them.
+
+def load_company_records(text, filename=''):
+    """ Parses JSONL or CSV text into a list of company detail dicts """
+    stripped = text.lstrip()
+    if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) or stripped.startswith('{'):
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [dict(row) for row in csv.DictReader(io.StringIO(text))]
+
+
+def company_record_key(company_details):
+    """ Content hash identifying a record for checkpointing """
+    normalized = normalize_company_details(company_details)
+    normalized['generation_mode'] = company_details.get('generation_mode') or BLUEPRINT_GENERATION_MODE
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def generate_admitted_blueprint(company_details, use_cache=True):
+    """ generate_ai_blueprint inside an admission slot, for records of an
+    uploaded batch, which share the slots with interactive requests """
+    started = time.perf_counter()
+    outcome = admission_queue.acquire(BLUEPRINT_QUEUE_TIMEOUT)
+    ADMISSION_TOTAL.inc(outcome=outcome)
+    if outcome != 'admitted':
+        return f"Error: No free generation slot ({outcome}), resubmit the file to resume."
+    ticket = open_ticket(time.perf_counter() - started)
+    try:
+        return generate_ai_blueprint(company_details, use_cache=use_cache)
+    finally:
+        finish_generation(ticket)
+
+
+def purge_batch_checkpoints(checkpoint_dir, max_age=None):
+    """ Deletes checkpoints older than max_age (default BLUEPRINT_BATCH_TTL) seconds """
+    cutoff = time.time() - (BLUEPRINT_BATCH_TTL if max_age is None else max_age)
+    try:
+        names = os.listdir(checkpoint_dir)
+    except OSError:
+        return
+    for name in names:
+        if not (name.endswith('.pdf') and ARTIFACT_ID_PATTERN.fullmatch(name[:-4])):
             continue
+        path = os.path.join(checkpoint_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def render_batch_record(company_details, checkpoint_dir, use_cache=True, blueprint_text=None, admit=False):
+    """ Returns the PDF bytes for one record, from its checkpoint if present
+    (unless the batch or the record asks to bypass the cache) """
+    use_cache = use_cache and not is_truthy(company_details.get('bypass_cache'))
+    path = os.path.join(checkpoint_dir, company_record_key(company_details) + '.pdf')
+    if use_cache and os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    if blueprint_text is None:
+        generate = generate_admitted_blueprint if admit else generate_ai_blueprint
+        blueprint_text = generate(company_details, use_cache=use_cache)
+    if blueprint_text.startswith("Error:"):
+        raise RuntimeError(blueprint_text)
+    pdf_buffer = create_pdf_blueprint(company_details.get('company_name'), blueprint_text)
+    if pdf_buffer is None:
+        raise RuntimeError("Failed to generate PDF document.")
+    pdf_bytes = pdf_buffer.getvalue()
+    write_file_atomic(path, pdf_bytes)
+    return pdf_bytes
 
-        lines = section.strip().split('\n', 1)
-        title = lines[0].strip()
-        content = lines[1].strip() if len(lines) > 1 else ""
 
-        # Add space before new sections except the first actual one
-        if not first_section:
-             story.append(Spacer(1, 0.3*inch))
+class ZipChunkWriter:
+    """ Write-only sink for zipfile. It has no tell/seek, so zipfile streams
+    entries with data descriptors and we can hand out bytes as they arrive. """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_batch_zip(records, checkpoint_dir, concurrency=None, use_cache=True, admit=False):
+    """ Generates the records with bounded concurrency and yields a ZIP of
+    their PDFs chunk by chunk, in completion order. Only a window of
+    2 x concurrency records is in flight at any time. Invalid or failed
+    records are listed in errors.json at the end of the archive. With
+    admit, each generation first waits for an admission slot. """
+    concurrency = concurrency or BLUEPRINT_BATCH_CONCURRENCY
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    purge_batch_checkpoints(checkpoint_dir)
+    errors = []
+    work = []
+    for index, company_details in enumerate(records, start=1):
+        error = company_details_error(company_details)
+        if error:
+            errors.append({"record": index, "error": error})
         else:
-             # The first part might be an intro from the AI before the first '##'
-             if title not in SOP_DATA: # Check if it's a real SOP title
-                  story.append(Paragraph(format_text_for_reportlab(section), styles['Normal']))
-                  continue # Skip adding it as a heading if it's not an SOP title
-             first_section = False
+            work.append((index, company_details))
+
+    sink = ZipChunkWriter()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="blueprint-batch")
+    try:
+        # PDFs are already compressed, so entries are stored as-is
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+            pending = iter(work)
+            in_flight = {}
 
+            def fill():
+                for index, company_details in pending:
+                    future = executor.submit(render_batch_record, company_details, checkpoint_dir, use_cache,
+                                             admit=admit)
+                    in_flight[future] = (index, company_details)
+                    if len(in_flight) >= concurrency * 2:
+                        break
 
-        story.append(Paragraph(title, styles['h2']))
-        story.append(Spacer(1, 0.1*inch))
-        story.append(Paragraph(format_text_for_reportlab(content), styles['Normal']))
+            fill()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, company_details = in_flight.pop(future)
+                    try:
+                        pdf_bytes = future.result()
+                    except Exception as e:
+                        print(f"Batch record {index} failed: {e}")
+                        errors.append({"record": index, "company_name": company_details.get('company_name'),
+                                       "error": str(e)})
+                        continue
+                    archive.writestr(f"{index:04d}_{blueprint_filename(company_details.get('company_name'))}", pdf_bytes)
+                    yield sink.drain()
+                fill()
 
+            if errors:
+                archive.writestr("errors.json", json.dumps(sorted(errors, key=lambda e: e['record']), indent=2))
+        yield sink.drain()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
-    # Add Page Breaks if needed (SimpleDocTemplate handles flow automatically)
-    # story.append(PageBreak())
 
+class OpenAIBatchBackend:
+    """ Provider batch API: roughly half the price, results within 24h """
+
+    def submit(self, request_lines):
+        payload = "\n".join(json.dumps(line) for line in request_lines).encode('utf-8')
+        client = get_client()
+        input_file = client.files.create(file=("blueprint_batch.jsonl", payload), purpose="batch")
+        batch = client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                      completion_window="24h")
+        return batch.id
+
+    def status(self, batch_id):
+        return get_client().batches.retrieve(batch_id).status
+
+    def results(self, batch_id):
+        client = get_client()
+        batch = client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.extend(line for line in client.files.content(file_id).text.splitlines() if line.strip())
+        return [json.loads(line) for line in lines]
+
+
+class LocalBatchBackend:
+    """ Local stand-in for the batch API. It runs each request line through
+    `client` right away and answers with output lines in the provider's
+    format, so the batch path can be exercised against a fake client. """
+
+    def __init__(self):
+        self._batches = {}
+
+    def submit(self, request_lines):
+        outputs = []
+        for line in request_lines:
+            try:
+                response = get_client().chat.completions.create(**line['body'])
+                outputs.append({"custom_id": line['custom_id'], "error": None, "response": {
+                    "status_code": 200,
+                    "body": {"choices": [{"message": {"content": response.choices[0].message.content},
+                                          "finish_reason": getattr(response.choices[0], 'finish_reason', 'stop')}]},
+                }})
+            except Exception as e:
+                outputs.append({"custom_id": line['custom_id'], "response": None,
+                                "error": {"message": str(e)}})
+        batch_id = f"local_batch_{uuid.uuid4().hex}"
+        self._batches[batch_id] = outputs
+        return batch_id
+
+    def status(self, batch_id):
+        return "completed" if batch_id in self._batches else None
+
+    def results(self, batch_id):
+        return self._batches[batch_id]
+
+
+BATCH_BACKENDS = {"openai": OpenAIBatchBackend, "local": LocalBatchBackend}
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def run_provider_batch(records, checkpoint_dir, backend, poll_interval=60):
+    """ Generates the not-yet-checkpointed records through a batch backend
+    and checkpoints their PDFs. The submitted batch id is saved in the
+    checkpoint directory, so an interrupted run resumes polling instead of
+    paying for a second batch. Only single-completion prompts are batched. """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    pending = {}
+    for company_details in records:
+        if company_details_error(company_details):
+            continue
+        if (company_details.get('generation_mode') or BLUEPRINT_GENERATION_MODE) in ('parallel', 'structured'):
+            continue  # fanned-out and repaired sections stay on the live path
+        key = company_record_key(company_details)
+        if not os.path.exists(os.path.join(checkpoint_dir, key + '.pdf')):
+            pending[key] = company_details
+    if not pending:
+        return 0
+
+    # Checkpoints of every input file share the directory, so the state is
+    # keyed by the records it was submitted for
+    digest = hashlib.sha256(''.join(sorted(pending)).encode('utf-8')).hexdigest()[:16]
+    state_path = os.path.join(checkpoint_dir, f"batch_state_{digest}.json")
+    batch_id = None
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            batch_id = json.load(f).get("batch_id")
+        if backend.status(batch_id) is None:
+            batch_id = None
+
+    prompts = {key: build_blueprint_prompt(normalize_company_details(details)) for key, details in pending.items()}
+    if batch_id is None:
+        request_lines = [{
+            "custom_id": key,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": OPENAI_MODEL,
+                "messages": [{"role": "system", "content": SYSTEM_MESSAGE},
+                             {"role": "user", "content": prompt}],
+                "temperature": OPENAI_TEMPERATURE,
+                "max_tokens": blueprint_max_tokens(pending[key]),
+            },
+        } for key, prompt in prompts.items()]
+        batch_id = backend.submit(request_lines)
+        write_file_atomic(state_path, json.dumps({"batch_id": batch_id}).encode('utf-8'))
+        print(f"Submitted batch {batch_id} with {len(request_lines)} request(s).")
+
+    status = backend.status(batch_id)
+    while status not in BATCH_TERMINAL_STATUSES:
+        print(f"Batch {batch_id} is {status}, checking again in {poll_interval}s...")
+        time.sleep(poll_interval)
+        status = backend.status(batch_id)
+    print(f"Batch {batch_id} finished with status '{status}'.")
+
+    rendered = 0
+    for output in (backend.results(batch_id) if status == "completed" else []):
+        key = output.get("custom_id")
+        if key not in pending:
+            continue
+        try:
+            blueprint_text = output["response"]["body"]["choices"][0]["message"]["content"].strip()
+        except (KeyError, IndexError, TypeError):
+            print(f"Batch request {key[:12]} failed: {output.get('error')}")
+            continue
+        # Seed the response cache too, so a later form submission for this company is free
+        blueprint_cache.put(blueprint_cache_key(prompts[key], blueprint_max_tokens(pending[key])), blueprint_text)
+        try:
+            render_batch_record(pending[key], checkpoint_dir, blueprint_text=blueprint_text)
+            rendered += 1
+        except Exception as e:
+            print(f"Batch record {pending[key].get('company_name')} failed: {e}")
+    os.remove(state_path)
+    return rendered
+
+
+@click.command("generate-batch")
+@with_appcontext
+@click.argument("records_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--output", "-o", default="blueprints.zip", show_default=True, help="ZIP file to write.")
+@click.option("--checkpoint-dir", default=None, help="Where finished PDFs are kept for resuming.")
+@click.option("--concurrency", default=BLUEPRINT_BATCH_CONCURRENCY, show_default=True, type=int)
+@click.option("--batch-api", type=click.Choice(sorted(BATCH_BACKENDS)), default=None,
+              help="Generate through the provider's offline batch API (or the local stand-in).")
+@click.option("--poll-interval", default=60, show_default=True, type=int)
+def generate_batch_command(records_file, output, checkpoint_dir, concurrency, batch_api, poll_interval):
+    """ Generates blueprints for every record in a JSONL or CSV file. """
+    with open(records_file, encoding='utf-8') as f:
+        records_text = f.read()
+    records = load_company_records(records_text, records_file)
+    checkpoint_dir = checkpoint_dir or BLUEPRINT_BATCH_DIR
+    click.echo(f"{len(records)} record(s), checkpoints in {checkpoint_dir}")
+
+    if batch_api:
+        run_provider_batch(records, checkpoint_dir, BATCH_BACKENDS[batch_api](), poll_interval=poll_interval)
+
+    with open(output, 'wb') as f:
+        for chunk in iter_batch_zip(records, checkpoint_dir, concurrency=concurrency):
+            f.write(chunk)
+    click.echo(f"Wrote {output}")
+
+
+# --- Async Serving ---
+# Used by the ASGI entry point (asgi.py). A generation there is a coroutine
+# waiting on AsyncOpenAI rather than a thread blocked on a socket, so one
+# worker can hold hundreds of them; CPU-bound and blocking steps (PDF
+# rendering, the artifact store, parallel-mode fan-out, cross-worker
+# leases) are handed to threads.
+
+_async_client = None
+
+
+def get_async_client():
+    """ AsyncOpenAI client, created on first use inside the worker's event loop """
+    global _async_client
+    if _async_client is None:
+        if not openai_api_key:
+            raise RuntimeError("OPENAI_API_KEY environment variable not set.")
+        _async_client = build_async_openai_client(openai_api_key)
+    return _async_client
+
+
+async def warm_up_async():
+    """ Opens a keep-alive connection on the async client, as warm_up()
+    does for the sync one. Run at ASGI lifespan startup, on the worker's
+    event loop. """
+    if not BLUEPRINT_WARMUP or not openai_api_key:
+        return
     try:
-        doc.build(story)
-        buffer.seek(0)
-        return buffer
+        await get_async_client().models.retrieve(OPENAI_MODEL)
     except Exception as e:
-        print(f"Error building PDF: {e}")
-        # Return None or raise exception to handle it in the route
-        return None
+        print(f"Warning: Async OpenAI warm-up failed ({type(e).__name__})")
+
+
+async def with_retries_async(call):
+    """ Awaits call() with the same backoff and shared retry budget as with_retries """
+    retry_budget.deposit()
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        try:
+            return await call()
+        except retryable_errors() as e:
+            if attempt >= OPENAI_MAX_RETRIES:
+                raise
+            if not retry_budget.withdraw():
+                OPENAI_EVENTS_TOTAL.inc(event="retry_budget_exhausted")
+                raise
+            delay = random.uniform(0, min(OPENAI_RETRY_MAX_DELAY, OPENAI_RETRY_BASE_DELAY * 2 ** attempt))
+            OPENAI_EVENTS_TOTAL.inc(event="retry")
+            print(f"OpenAI call failed ({type(e).__name__}), retrying in {delay:.2f}s...")
+            await asyncio.sleep(delay)
+
+
+async def create_completion_async(**params):
+    """ Non-streamed completion on the async client (hedging is only done
+    by the threaded transport) """
+    async_client = get_async_client()
+    return await with_retries_async(lambda: async_client.chat.completions.create(**params))
+
+
+class AsyncSingleFlight:
+    """ SingleFlight for coroutines on one event loop """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+    async def run(self, key, func, timeout):
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            COALESCED_TOTAL.inc(kind=self.name)
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                raise CoalesceTimeout(f"Timed out after {timeout:.0f}s waiting for an identical in-flight {self.name}.")
+            except asyncio.CancelledError:
+                # Only a cancelled leader (its client went away) is taken over
+                if asyncio.current_task().cancelling() or not future.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # retrieved here so an unjoined failure is not reported twice
+            raise
+        finally:
+            del self._calls[key]
+
+
+async_generation_flights = AsyncSingleFlight("generation")
+
+
+async def generate_ai_blueprint_async(company_details, use_cache=True, mode=None):
+    """ Coroutine version of generate_ai_blueprint """
+    mode = mode or company_details.get('generation_mode') or BLUEPRINT_GENERATION_MODE
+    if mode in ('parallel', 'structured') or (generation_lease is not None and use_cache):
+        # These block (section pool / lease polling): run them on a thread
+        return await asyncio.to_thread(generate_ai_blueprint, company_details, use_cache, mode)
+
+    if not use_cache:
+        return await generate_ai_blueprint_single_async(company_details, use_cache=False)
+    key = generation_flight_key(company_details, mode)
+    try:
+        return await async_generation_flights.run(
+            key, lambda: generate_ai_blueprint_single_async(company_details, use_cache), BLUEPRINT_COALESCE_WAIT)
+    except CoalesceTimeout as e:
+        print(f"Coalescing timeout: {e}")
+        return f"Error: {e}"
+
+
+async def generate_ai_blueprint_single_async(company_details, use_cache=True):
+    # The cache tiers are SQLite: every lookup and write runs off the event loop
+    prompt, cache_key, cached_text = await asyncio.to_thread(prepare_blueprint_prompt, company_details, use_cache)
+    if cached_text is not None:
+        return cached_text
+
+    cached = await asyncio.to_thread(cached_sections, company_details) if use_cache else None
+    if cached:
+        blueprint_text = await asyncio.to_thread(generate_blueprint_sections, company_details, cached=cached)
+        if not blueprint_text.startswith("Error:"):
+            await asyncio.to_thread(blueprint_cache.put, cache_key, blueprint_text)
+        return blueprint_text
+
+    try:
+        with timed_stage('completion'):
+            response = await create_completion_async(**blueprint_completion_params(
+                prompt, blueprint_max_tokens(company_details)))
+        blueprint_text = await asyncio.to_thread(finish_blueprint_response, response, cache_key)
+        if not blueprint_text.startswith("Error:"):
+            await asyncio.to_thread(cache_blueprint_sections, company_details, blueprint_text)
+        return blueprint_text
+
+    except Exception as e:
+        print(f"Error calling OpenAI API: {e}")
+        return f"Error: Failed to generate blueprint using AI. Details: {str(e)}"
+
+
+def render_and_store_blueprint(company_details, blueprint_text):
+    """ Builds the PDF and stores the artifact. Returns (pdf_buffer, blueprint_id),
+    or (None, None) when rendering fails. """
+    company_name = company_details.get('company_name')
+    pdf_buffer = create_pdf_blueprint(company_name, blueprint_text)
+    if pdf_buffer is None:
+        return None, None
+    return pdf_buffer, artifact_store.put(company_name, blueprint_text, pdf_buffer.getvalue(), company_details)
+
+
+async def generate_blueprint_endpoint_async():
+    """ Async twin of generate_blueprint_endpoint, dispatched by asgi.py
+    inside the Flask request context for POST /generate_blueprint """
+    with timed_stage('validation'):
+        company_details, error = parse_company_details(request)
+    if error:
+        return jsonify({"error": error}), 400
+
+    use_cache = not wants_cache_bypass(request, company_details)
+    rejected = check_rate_limit(request)
+    if rejected is not None:
+        return rejected
+    if wants_background_job(request, company_details):
+        return submit_blueprint_job(company_details, use_cache)
+
+    with timed_stage('admission'):
+        ticket, rejected = await admit_generation_async()
+    if rejected is not None:
+        return rejected
+    try:
+        response = make_response(await build_blueprint_download_async(
+            company_details, use_cache, wants_html_preview(request, company_details)))
+    finally:
+        finish_generation(ticket)
+    return add_route_headers(response, ticket)
+
+
+async def build_blueprint_download_async(company_details, use_cache, html_preview=False):
+    print("Generating AI blueprint...")
+    blueprint_text = await generate_ai_blueprint_async(company_details, use_cache=use_cache)
+    if blueprint_text.startswith("Error:"):
+        print(f"AI Generation Failed: {blueprint_text}")
+        return jsonify({"error": blueprint_text}), 500
+    if html_preview:
+        return await asyncio.to_thread(blueprint_preview_response, company_details, blueprint_text)
+
+    print("Creating PDF document...")
+    company_name = company_details.get('company_name')
+    pdf_buffer, blueprint_id = await asyncio.to_thread(render_and_store_blueprint, company_details, blueprint_text)
+    if pdf_buffer is None:
+        print("PDF Generation Failed.")
+        return jsonify({"error": "Failed to generate PDF document."}), 500
+    return blueprint_pdf_response(pdf_buffer, company_name, blueprint_id)
 
 
 # --- Flask Route ---
 
-@app.route('/generate_blueprint', methods=['POST'])
 def generate_blueprint_endpoint():
     """
     API endpoint to generate the performance marketing blueprint PDF.
     Expects form data: company_name, product_service, target_audience, business_goal,
                        website (optional), current_marketing (optional)
+    Pass async=true (query string or field) to get a job id back immediately
+    and poll /jobs/<job_id> instead of waiting for the PDF.
+    Pass generation_mode=parallel to generate the SOP sections concurrently,
+    or generation_mode=structured for JSON output with per-section repair.
+    Browsers (or format=html) get an HTML preview page instead of the PDF,
+    which is then rendered when its download link is followed.
     """
-    if not request.is_json:
-         # Fallback for form data if not JSON
-         if not request.form:
-             return jsonify({"error": "Missing form data or JSON payload"}), 400
-         company_details = request.form.to_dict()
-    else:
-        company_details = request.get_json()
+    with timed_stage('validation'):
+        company_details, error = parse_company_details(request)
+    if error:
+        return jsonify({"error": error}), 400
 
-    # Basic Validation
-    required_fields = ['company_name', 'product_service', 'target_audience', 'business_goal']
-    if not all(field in company_details and company_details[field] for field in required_fields):
-        missing = [field for field in required_fields if not company_details.get(field)]
-        return jsonify({"error": f"Missing required fields: {', '.join(missing)}"}), 400
+    use_cache = not wants_cache_bypass(request, company_details)
+
+    rejected = check_rate_limit(request)
+    if rejected is not None:
+        return rejected
 
+    # Opt-in async mode: queue the work and hand back a job id straight away
+    if wants_background_job(request, company_details):
+        return submit_blueprint_job(company_details, use_cache)
+
+    with timed_stage('admission'):
+        ticket, rejected = admit_generation()
+    if rejected is not None:
+        return rejected
+    try:
+        response = make_response(build_blueprint_download(company_details, use_cache,
+                                                          wants_html_preview(request, company_details)))
+    finally:
+        finish_generation(ticket)
+    return add_route_headers(response, ticket)
+
+
+def build_blueprint_download(company_details, use_cache, html_preview=False):
+    """ Generates the text, renders and stores the PDF, and returns the
+    download response (or the preview page, without rendering the PDF) """
     # 1. Generate Blueprint Text using AI
     print("Generating AI blueprint...")
-    blueprint_text = generate_ai_blueprint(company_details)
+    blueprint_text = generate_ai_blueprint(company_details, use_cache=use_cache)
 
     if blueprint_text.startswith("Error:"):
         print(f"AI Generation Failed: {blueprint_text}")
         return jsonify({"error": blueprint_text}), 500
 
     print("AI Blueprint generated successfully.")
+    if html_preview:
+        return blueprint_preview_response(company_details, blueprint_text)
 
     # 2. Create PDF from the generated text
     print("Creating PDF document...")
@@ -365,20 +3237,303 @@ def generate_blueprint_endpoint():
          return jsonify({"error": "Failed to generate PDF document."}), 500
 
     print("PDF created successfully.")
+    blueprint_id = artifact_store.put(company_details.get('company_name'), blueprint_text, pdf_buffer.getvalue(),
+                                      company_details)
 
     # 3. Send PDF back to the user for download
-    safe_company_name = "".join(c for c in company_details.get('company_name', 'Client') if c.isalnum() or c in (' ', '_')).rstrip()
-    filename = f"Performance_Blueprint_{safe_company_name}_{datetime.date.today()}.pdf"
+    return blueprint_pdf_response(pdf_buffer, company_details.get('company_name'), blueprint_id)
 
-    return send_file(
+
+def wants_background_job(req, company_details):
+    return is_truthy(req.args.get('async')) or is_truthy(company_details.get('async'))
+
+
+def submit_blueprint_job(company_details, use_cache):
+    """ Queues a background job and returns the 202 response pointing at it """
+    job, error = blueprint_jobs.submit(company_details, use_cache=use_cache)
+    if error:
+        return jsonify({"error": error}), 503
+    return jsonify({
+        "job_id": job['id'],
+        "status": job['status'],
+        "status_url": f"/jobs/{job['id']}",
+        "pdf_url": f"/jobs/{job['id']}/pdf",
+    }), 202
+
+
+def blueprint_pdf_response(pdf_buffer, company_name, blueprint_id):
+    """ Download response for a freshly generated blueprint PDF """
+    response = send_file(
         pdf_buffer,
         mimetype='application/pdf',
         as_attachment=True,
-        download_name=filename
+        download_name=blueprint_filename(company_name),
+        etag=blueprint_id or False
+    )
+    if blueprint_id is not None:
+        response.headers['X-Blueprint-Id'] = blueprint_id
+        response.headers['X-Blueprint-Url'] = f"/blueprints/{blueprint_id}"
+    return response
+
+
+def wants_html_preview(req, company_details):
+    """ format=html or format=pdf picks the response; without it, clients
+    that prefer text/html (browsers) get the preview and the rest the PDF """
+    requested = (req.args.get('format') or company_details.get('format') or '').strip().lower()
+    if requested in ('html', 'pdf'):
+        return requested == 'html'
+    return req.accept_mimetypes.best_match(['application/pdf', 'text/html']) == 'text/html'
+
+
+def blueprint_preview_response(company_details, blueprint_text):
+    """ Stores the text without a PDF and returns the preview page """
+    company_name = company_details.get('company_name')
+    with timed_stage('html_render'):
+        blueprint_id = artifact_store.put(company_name, blueprint_text, company_details=company_details)
+        response = make_response(render_template(
+            'index.html',
+            preview=blueprint_html(parse_blueprint_markdown(blueprint_text)),
+            company_name=company_name,
+            prepared_on=datetime.date.today().strftime('%B %d, %Y'),
+            pdf_url=f"/blueprints/{blueprint_id}" if blueprint_id is not None else None
+        ))
+    if blueprint_id is not None:
+        response.headers['X-Blueprint-Id'] = blueprint_id
+        response.headers['X-Blueprint-Url'] = f"/blueprints/{blueprint_id}"
+    return response
+
+
+def generate_blueprint_stream_endpoint():
+    """
+    Streams the blueprint over Server-Sent Events as it is generated.
+    Takes the same fields as /generate_blueprint. The 'done' event carries
+    the pdf_url of the stored blueprint; its PDF is rendered on the first
+    download.
+    """
+    with timed_stage('validation'):
+        company_details, error = parse_company_details(request)
+    if error:
+        return jsonify({"error": error}), 400
+
+    use_cache = not wants_cache_bypass(request, company_details)
+    rejected = check_rate_limit(request)
+    if rejected is not None:
+        return rejected
+
+    # Admitted before the response starts, so a rejection is still a plain 429.
+    # The body runs after this view returns: it sets the route itself, and the
+    # slot is freed when the server closes the response (finished or not).
+    with timed_stage('admission'):
+        ticket, rejected = admit_generation(bind_route=False)
+    if rejected is not None:
+        return rejected
+
+    def event_stream():
+        token = current_route.set(ticket.route)
+        try:
+            # An immediate comment line gets headers and first bytes out before the API answers
+            yield ": stream open\n\n"
+            for event, data in stream_ai_blueprint(company_details, use_cache=use_cache):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            current_route.reset(token)
+
+    response = Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(lambda: finish_generation(ticket))
+    return add_route_headers(response, ticket)
+
+
+def generate_blueprint_batch_endpoint():
+    """
+    Bulk generation: upload a JSONL or CSV file of company records (as a
+    'records' file field or as the raw request body) and receive a ZIP of
+    PDFs, streamed as each blueprint completes. Resubmitting the same file
+    resumes from the checkpointed PDFs, unless it is sent with
+    Cache-Control: no-cache or ?bypass_cache=true.
+    """
+    upload = request.files.get('records')
+    if upload is not None:
+        try:
+            records_text, filename = upload.read().decode('utf-8'), upload.filename or ''
+        except UnicodeDecodeError:
+            return jsonify({"error": "Records file must be UTF-8 encoded"}), 400
+    else:
+        records_text, filename = request.get_data(as_text=True), ''
+    if not records_text.strip():
+        return jsonify({"error": "Missing records file"}), 400
+
+    try:
+        records = load_company_records(records_text, filename)
+    except (ValueError, csv.Error) as e:
+        return jsonify({"error": f"Could not parse records: {e}"}), 400
+    if not any(company_details_error(record) is None for record in records):
+        return jsonify({"error": "No valid company records found"}), 400
+    rejected = check_rate_limit(request)
+    if rejected is not None:
+        return rejected
+
+    concurrency = min(request.args.get('concurrency', BLUEPRINT_BATCH_CONCURRENCY, type=int),
+                      BLUEPRINT_BATCH_CONCURRENCY)
+    use_cache = not wants_cache_bypass(request, request.args)
+    return Response(
+        stream_with_context(iter_batch_zip(records, BLUEPRINT_BATCH_DIR, concurrency=max(1, concurrency),
+                                           use_cache=use_cache, admit=True)),
+        mimetype='application/zip',
+        headers={"Content-Disposition": f"attachment; filename=Performance_Blueprints_{datetime.date.today()}.zip"}
+    )
+
+
+def blueprint_pdf_endpoint(blueprint_id):
+    """ Downloads a stored blueprint PDF, rendering it first if the
+    blueprint was only previewed. Supports If-None-Match,
+    If-Modified-Since and Range requests. """
+    metadata = artifact_store.metadata(blueprint_id)
+    if metadata is None:
+        return jsonify({"error": "Unknown or expired blueprint id."}), 404
+    if not metadata['rendered'] and not render_stored_pdf(blueprint_id, metadata):
+        print("PDF Generation Failed.")
+        return jsonify({"error": "Failed to generate PDF document."}), 500
+    try:
+        response = send_file(
+            artifact_store.path(blueprint_id, 'pdf'),
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=metadata['filename'],
+            etag=blueprint_id,
+            last_modified=metadata['last_modified'],
+            conditional=True,
+            max_age=86400
+        )
+    except FileNotFoundError:
+        # Evicted between the metadata read and the open
+        return jsonify({"error": "Unknown or expired blueprint id."}), 404
+    artifact_store.touch(blueprint_id)
+    return response
+
+
+def blueprint_text_endpoint(blueprint_id):
+    """ The generated blueprint text behind a stored PDF """
+    blueprint_text = artifact_store.text(blueprint_id) if artifact_store.metadata(blueprint_id) else None
+    if blueprint_text is None:
+        return jsonify({"error": "Unknown or expired blueprint id."}), 404
+    return Response(blueprint_text, mimetype='text/plain')
+
+
+def regenerate_section_endpoint(blueprint_id):
+    """
+    Regenerates one section of a stored blueprint and returns the new PDF
+    (or, as for /generate_blueprint, the HTML preview).
+    Expects form data or JSON: section (the SOP title or id, or Concluding Remarks).
+    Company fields sent along replace the ones the blueprint was generated
+    from; every other section is kept as written.
+    """
+    metadata = artifact_store.metadata(blueprint_id)
+    blueprint_text = artifact_store.text(blueprint_id) if metadata else None
+    if blueprint_text is None:
+        return jsonify({"error": "Unknown or expired blueprint id."}), 404
+
+    with timed_stage('validation'):
+        payload = request.get_json(silent=True) if request.is_json else request.form.to_dict()
+        payload = payload if isinstance(payload, dict) else {}
+        company_details = dict(metadata.get('company_details') or {})
+        company_details.update({field: payload[field] for field in COMPANY_FIELDS if payload.get(field)})
+        # Only the sections of the blueprint's own SOP selection can be regenerated
+        sections = blueprint_sections(company_details)
+        section = str(payload.get('section') or '')
+        title = get_sop_catalog().index.get(section.strip().lower()) or match_section_title(section)
+        if title not in sections:
+            return jsonify({"error": "Unknown section.", "sections": list(sections)}), 400
+        missing = validate_company_details(company_details)
+        if missing:
+            return jsonify({"error": f"Missing required fields: {', '.join(missing)}"}), 400
+
+    rejected = check_rate_limit(request)
+    if rejected is not None:
+        return rejected
+    with timed_stage('admission'):
+        ticket, rejected = admit_generation()
+    if rejected is not None:
+        return rejected
+
+    print(f"Regenerating section '{title}' of blueprint {blueprint_id[:12]}...")
+    try:
+        section_text = generate_blueprint_section(company_details, title)
+    except Exception as e:
+        print(f"Error regenerating section '{title}': {e}")
+        return jsonify({"error": f"Error: Failed to regenerate section using AI. Details: {str(e)}"}), 500
+    finally:
+        finish_generation(ticket)
+
+    blueprint_text = replace_blueprint_section(blueprint_text, title, section_text)
+    if wants_html_preview(request, payload):
+        response = blueprint_preview_response(company_details, blueprint_text)
+    else:
+        pdf_buffer, new_blueprint_id = render_and_store_blueprint(company_details, blueprint_text)
+        if pdf_buffer is None:
+            print("PDF Generation Failed.")
+            return jsonify({"error": "Failed to generate PDF document."}), 500
+        response = blueprint_pdf_response(pdf_buffer, company_details.get('company_name'), new_blueprint_id)
+    response.headers['X-Blueprint-Section'] = title
+    return add_route_headers(response, ticket)
+
+
+def job_status_endpoint(job_id):
+    """ Status and progress of an async blueprint job """
+    job = blueprint_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job id."}), 404
+    return jsonify(blueprint_jobs.describe(job))
+
+
+def job_pdf_endpoint(job_id):
+    """ Downloads the PDF of a finished async blueprint job """
+    job = blueprint_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job id."}), 404
+    if job['status'] == 'failed':
+        return jsonify({"error": job['error']}), 500
+    if job['status'] != 'done':
+        return jsonify(blueprint_jobs.describe(job)), 409
+    return send_file(
+        io.BytesIO(job['pdf']),
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=job['filename']
     )
 
+def metrics_endpoint():
+    """ Prometheus scrape endpoint (per worker process) """
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def cache_stats_endpoint():
+    """ Hit/miss counters for the blueprint and section caches """
+    return jsonify(dict(blueprint_cache.snapshot(), sections=section_cache.snapshot()))
+
+
+def sop_catalog_endpoint():
+    """ The SOPs and packages a request can select with the sops and
+    sop_package fields """
+    catalog = get_sop_catalog()
+    ids = {sop['title']: sop['id'] for sop in catalog.registry.values()}
+    return jsonify({
+        "version": catalog.version,
+        "sops": [{"id": sop['id'], "title": sop['title'], "objective": sop['objective'], "timeline": sop['timeline']}
+                 for sop in catalog.registry.values()],
+        "packages": {name: {"description": package['description'], "sops": [ids[title] for title in package['titles']]}
+                     for name, package in catalog.packages.items()},
+    })
+
+
+def healthz_endpoint():
+    """ Liveness check for the load balancer: touches neither OpenAI nor ReportLab """
+    return jsonify({"status": "ok", "warm": warm_up_done.is_set()})
+
 # Basic route for testing if the server is up
-@app.route('/')
 def index():
      return render_template('index.html')
     # return """
@@ -494,10 +3649,88 @@ def index():
     # </html>
     # """
 
+# --- App Factory ---
+
+ROUTES = [
+    ('/generate_blueprint', generate_blueprint_endpoint, ['POST']),
+    ('/generate_blueprint/stream', generate_blueprint_stream_endpoint, ['POST']),
+    ('/generate_blueprint/batch', generate_blueprint_batch_endpoint, ['POST']),
+    ('/blueprints/<blueprint_id>', blueprint_pdf_endpoint, ['GET']),
+    ('/blueprints/<blueprint_id>/text', blueprint_text_endpoint, ['GET']),
+    ('/blueprints/<blueprint_id>/sections', regenerate_section_endpoint, ['POST']),
+    ('/jobs/<job_id>', job_status_endpoint, ['GET']),
+    ('/jobs/<job_id>/pdf', job_pdf_endpoint, ['GET']),
+    ('/metrics', metrics_endpoint, ['GET']),
+    ('/cache/stats', cache_stats_endpoint, ['GET']),
+    ('/sops', sop_catalog_endpoint, ['GET']),
+    ('/healthz', healthz_endpoint, ['GET']),
+    ('/', index, ['GET']),
+]
+
+
+def create_app():
+    """ Builds the Flask app. Cheap: the OpenAI client and ReportLab are
+    loaded on first use or by start_warm_up(). """
+    app = Flask(__name__)
+    for rule, view_func, methods in ROUTES:
+        app.add_url_rule(rule, view_func=view_func, methods=methods)
+    app.before_request(start_request_trace)
+    app.after_request(record_request_metrics)
+    # Loaded here so a broken catalog fails the start instead of the first request
+    get_sop_catalog()
+    app.context_processor(lambda: {"sop_packages": get_sop_catalog().packages})
+    if BLUEPRINT_PROXY_HOPS:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=BLUEPRINT_PROXY_HOPS)
+    app.wsgi_app = instrument_wsgi(app.wsgi_app)
+    app.cli.add_command(generate_batch_command)
+    return app
+
+
+# --- Warm-up ---
+# New instances answer /healthz straight away; the first blueprint request
+# would still pay for importing ReportLab, loading its fonts, spawning the
+# PDF workers and the TLS handshake with the API. start_warm_up() does that
+# on a background thread while the server starts listening.
+
+warm_up_done = threading.Event()
+
+
+def warm_up():
+    started = time.perf_counter()
+    try:
+        render_pdf_bytes("Warm-up", "## Warm-up\n- **Ready**")  # ReportLab, fonts and styles in this process
+        pool = get_pdf_pool()
+        if pool is not None:
+            futures = [pool.submit(render_pdf_bytes, "Warm-up", "## Warm-up") for _ in range(BLUEPRINT_PDF_PROCESSES)]
+            wait(futures, timeout=BLUEPRINT_PDF_TIMEOUT)
+    except Exception as e:
+        print(f"Warning: PDF warm-up failed: {e}")
+    if openai_api_key:
+        try:
+            # Any cheap authenticated call leaves a keep-alive connection in the pool
+            get_client().models.retrieve(OPENAI_MODEL)
+        except Exception as e:
+            print(f"Warning: OpenAI warm-up failed ({type(e).__name__})")
+    warm_up_done.set()
+    print(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+
+def start_warm_up():
+    """ Runs warm_up() on a daemon thread unless BLUEPRINT_WARMUP is off """
+    if not BLUEPRINT_WARMUP:
+        return None
+    thread = threading.Thread(target=warm_up, name="blueprint-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+app = create_app()
+
 # --- Main Execution ---
 # if __name__ == '__main__':
 #     # Use waitress or gunicorn for production instead of Flask's built-in server
 #     app.run(debug=True, port=5001) # Run on a different port if 5000 is common
 
 if __name__ == "__main__":
+    start_warm_up()
     app.run(host="0.0.0.0", port=10000)  # Render assigns a port dynamically
@@ -0,0 +1,169 @@
+""" ASGI entry point.
+
+POST /generate_blueprint is served by a coroutine (AsyncOpenAI for the
+completion, a thread for the PDF), so a worker holds hundreds of in-flight
+generations on one event loop. Every other route is the unchanged Flask
+app behind a WSGI thread pool.
+
+Run with `python asgi.py` (see the procfile). WEB_CONCURRENCY sets the
+number of worker processes and PORT the port. It defaults to one worker:
+background job records, metrics, admission slots and rate limit buckets
+live in each worker's memory, so with several workers GET /jobs/<id>
+only answers on the worker that took the job.
+"""
+import os
+import io
+import sys
+import asyncio
+
+from a2wsgi import WSGIMiddleware
+from flask import jsonify
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Each worker has its own PDF process pool: split the CPUs between them.
+# This has to be set before app is imported, which reads it.
+os.environ.setdefault("BLUEPRINT_PDF_PROCESSES",
+                      str(max(1, min(4, (os.cpu_count() or 1) // WEB_CONCURRENCY))))
+# uvicorn resolves X-Forwarded-For, but only from the proxy addresses in
+# FORWARDED_ALLOW_IPS (comma separated, default 127.0.0.1); anyone else's
+# header is ignored. The app must not apply its own WSGI ProxyFix on top.
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+os.environ["BLUEPRINT_PROXY_HOPS"] = "0"
+
+import app as blueprint_app
+from app import app as flask_app, generate_blueprint_endpoint_async, finish_request_trace
+
+# Threads for the routes that stay on WSGI (downloads, SSE streams, jobs, ...)
+BLUEPRINT_WSGI_THREADS = int(os.getenv("BLUEPRINT_WSGI_THREADS", "32"))
+
+
+def build_environ(scope, body):
+    """ WSGI environ for an ASGI HTTP scope whose body has been read """
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    server = scope.get("server") or ("localhost", 80)
+    environ["SERVER_NAME"] = server[0]
+    environ["SERVER_PORT"] = str(server[1] or 80)
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def send_response(response, environ, send):
+    app_iter, status, headers = response.get_wsgi_response(environ)
+    await send({
+        "type": "http.response.start",
+        "status": int(status.split(" ", 1)[0]),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    })
+    try:
+        for chunk in app_iter:
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+        finish_request_trace(environ)
+
+
+async def generate_blueprint(scope, receive, send):
+    """ POST /generate_blueprint inside a Flask request context, so the
+    request hooks (metrics, traces) run as they do under WSGI """
+    body = await read_body(receive)
+    if body is None:
+        return
+    environ = build_environ(scope, body)
+    with flask_app.request_context(environ):
+        try:
+            rv = flask_app.preprocess_request()
+            if rv is None:
+                rv = await generate_blueprint_endpoint_async()
+            response = flask_app.process_response(flask_app.make_response(rv))
+        except Exception as e:
+            flask_app.log_exception(sys.exc_info())
+            response = flask_app.make_response((jsonify({"error": f"Error: {e}"}), 500))
+    await send_response(response, environ, send)
+
+
+async def lifespan(receive, send):
+    warm_up_task = None
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            blueprint_app.start_warm_up()
+            # The async client belongs to this event loop, so it is warmed here
+            warm_up_task = asyncio.create_task(blueprint_app.warm_up_async())
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # The server has stopped accepting connections and waited for the
+            # open ones; finish queued background jobs before the pools go away
+            unfinished = await asyncio.to_thread(blueprint_app.blueprint_jobs.drain,
+                                                 blueprint_app.BLUEPRINT_DRAIN_SECONDS)
+            if unfinished:
+                print(f"Shutting down with {unfinished} unfinished blueprint job(s).")
+            blueprint_app.reset_pdf_pool()
+            if warm_up_task is not None:
+                warm_up_task.cancel()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+wsgi_application = WSGIMiddleware(flask_app, workers=BLUEPRINT_WSGI_THREADS)
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/generate_blueprint":
+        return await generate_blueprint(scope, receive, send)
+    return await wsgi_application(scope, receive, send)
+
+
+def main():
+    import uvicorn
+
+    uvicorn.run(
+        "asgi:application",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "10000")),
+        workers=WEB_CONCURRENCY,
+        lifespan="on",
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        timeout_graceful_shutdown=int(blueprint_app.BLUEPRINT_DRAIN_SECONDS),
+    )
+
+
+if __name__ == "__main__":
+    main()
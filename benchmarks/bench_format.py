@@ -0,0 +1,62 @@
+"""
+Micro-benchmarks for blueprint text -> PDF across blueprint sizes.
+
+    python benchmarks/bench_format.py --sizes 1,4,16 --json results/format.json
+
+Times the Markdown tokenizer (parse_blueprint_markdown), inline markup
+conversion (format_inline_markup) and a full create_pdf_blueprint render
+for synthetic blueprints with 1x, 4x, ... the usual section length.
+Rendering runs inline (no process pool) so only layout cost is measured.
+"""
+import os
+import time
+import argparse
+
+import _common
+from _common import write_results
+
+os.environ["BLUEPRINT_PDF_PROCESSES"] = "0"
+
+import app  # noqa: E402
+from bench_pdf import synthetic_blueprint  # noqa: E402
+
+
+def best_of(repeat, func, *args):
+    """ Fastest of `repeat` runs, in seconds """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for blueprint formatting and PDF rendering.")
+    parser.add_argument("--sizes", default="1,4,16", help="Paragraphs per section, comma separated")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", dest="json_path", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'size':>5} {'chars':>9} {'parse ms':>9} {'inline ms':>10} {'pdf ms':>9} {'pdf KiB':>8}")
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        text = synthetic_blueprint(size)
+        parse_seconds = best_of(args.repeat, app.parse_blueprint_markdown, text)
+        inline_seconds = best_of(args.repeat, app.format_inline_markup, text)
+        pdf_seconds = best_of(max(1, args.repeat // 2), app.create_pdf_blueprint, "Benchmark Co", text)
+        pdf_size = len(app.create_pdf_blueprint("Benchmark Co", text).getvalue())
+        row = {"paragraphs_per_section": size, "chars": len(text),
+               "parse_ms": round(parse_seconds * 1000, 3), "inline_ms": round(inline_seconds * 1000, 3),
+               "pdf_ms": round(pdf_seconds * 1000, 2), "pdf_bytes": pdf_size}
+        results.append(row)
+        print(f"{size:>5} {len(text):>9} {row['parse_ms']:>9.2f} {row['inline_ms']:>10.2f} "
+              f"{row['pdf_ms']:>9.1f} {pdf_size / 1024:>8.1f}")
+
+    if args.json_path:
+        write_results(args.json_path, "format", results, sizes=args.sizes, repeat=args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+PDF rendering throughput vs. process pool size.
+
+    python benchmarks/bench_pdf.py --renders 40 --json bench_pdf.json
+
+Renders the same synthetic blueprint with render_pdf_bytes, first on the
+calling thread and then through process pools of increasing size, and
+reports PDFs per second for each. No OpenAI calls are made.
+"""
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import _common
+from _common import write_results
+
+import app
+
+
+def synthetic_blueprint(paragraphs_per_section=4):
+    """ A blueprint shaped like real model output: every SOP as a '## ' section """
+    paragraph = ("We will approach this phase with a **data-driven** plan tailored to the client's "
+                 "audience, aligning messaging, channels and measurement with the key business goal. ") * 3
+    checklist = "\n".join(f"- {item}" for item in ("Kick-off workshop", "Channel audit", "Weekly reporting"))
+    sections = ["Here is the proposed blueprint."]
+    for title in app.get_sop_catalog().registry:
+        sections.append(f"## {title}\n" + "\n\n".join([paragraph] * paragraphs_per_section) + "\n\n" + checklist)
+    return "\n\n".join(sections)
+
+
+def run(workers, renders, text):
+    if workers == 0:
+        start = time.perf_counter()
+        for _ in range(renders):
+            app.render_pdf_bytes("Benchmark Co", text)
+        return time.perf_counter() - start
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Warm-up: start every worker and import the app before timing
+        list(pool.map(app.render_pdf_bytes, ["Warm-up"] * workers, [text] * workers))
+        start = time.perf_counter()
+        list(pool.map(app.render_pdf_bytes, ["Benchmark Co"] * renders, [text] * renders))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--renders", type=int, default=24)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--paragraphs", type=int, default=4, help="Paragraphs per SOP section")
+    parser.add_argument("--json", dest="json_path", help="Write results to this file")
+    args = parser.parse_args()
+
+    text = synthetic_blueprint(args.paragraphs)
+    pool_sizes = [0] + [n for n in (1, 2, 4, 8, 16, 32) if n <= args.max_workers]
+    results = []
+    baseline = None
+    print(f"{'workers':>8} {'seconds':>9} {'pdf/s':>8} {'speedup':>8}")
+    for workers in pool_sizes:
+        elapsed = run(workers, args.renders, text)
+        throughput = args.renders / elapsed
+        baseline = baseline or throughput
+        results.append({"workers": workers, "renders": args.renders, "seconds": round(elapsed, 3),
+                        "pdfs_per_second": round(throughput, 2), "speedup": round(throughput / baseline, 2)})
+        label = "inline" if workers == 0 else str(workers)
+        print(f"{label:>8} {elapsed:>9.2f} {throughput:>8.2f} {throughput / baseline:>7.2f}x")
+
+    if args.json_path:
+        write_results(args.json_path, "pdf_render", results, renders=args.renders, paragraphs=args.paragraphs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Cold-start profile of the app: import time and time to first response.
+
+    python benchmarks/bench_startup.py --runs 5 --budget-ms 500 --json results/startup.json
+
+Each run is a fresh interpreter started with -X importtime that imports
+app, answers GET /healthz through the test client and then renders one
+PDF. Reports the median import and /healthz times, the slowest imports,
+and the cost that lazy loading moves to the first PDF. Exits non-zero if
+openai, httpx, pydantic or reportlab were imported before the first PDF, or if the
+median import exceeds --budget-ms, so it can gate CI.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+import _common
+from _common import ROOT, percentile, write_results
+
+HEAVY_MODULES = ("openai", "httpx", "pydantic", "reportlab")
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/healthz')
+healthz = time.perf_counter()
+loaded = [name for name in {heavy!r} if name in sys.modules]
+app.render_pdf_bytes('Benchmark Co', '## Section\\n- item')
+first_pdf = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - start) * 1000, "healthz_ms": (healthz - imported) * 1000,
+                  "healthz_status": response.status_code, "first_pdf_ms": (first_pdf - healthz) * 1000,
+                  "heavy_loaded": loaded}}))
+"""
+
+
+def parse_importtime(stderr):
+    """ (cumulative_us, module) pairs from -X importtime output, up to and
+    including `import app` (later lines are lazy imports) """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), module.strip()))
+        if module.strip() == "app":
+            break
+    return rows
+
+
+def run_once():
+    env = dict(os.environ, BLUEPRINT_PDF_PROCESSES="0", BLUEPRINT_WARMUP="0")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(heavy=HEAVY_MODULES)],
+                          cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["imports"] = parse_importtime(proc.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time and first-response profile of the app.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Fail if the median import is slower")
+    parser.add_argument("--json", dest="json_path", help="Write results to this file")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    summary = {key: round(percentile([run[key] for run in runs], 50), 1)
+               for key in ("import_ms", "healthz_ms", "first_pdf_ms")}
+    heavy_loaded = sorted({name for run in runs for name in run["heavy_loaded"]})
+    slowest = sorted(runs[-1]["imports"], reverse=True)[:args.top]
+
+    print(f"import app:   {summary['import_ms']:>8.1f} ms (median of {args.runs})")
+    print(f"/healthz:     {summary['healthz_ms']:>8.1f} ms")
+    print(f"first PDF:    {summary['first_pdf_ms']:>8.1f} ms (includes loading ReportLab)")
+    print(f"heavy modules loaded before the first PDF: {', '.join(heavy_loaded) or 'none'}")
+    print("slowest imports at startup (cumulative):")
+    for cumulative, module in slowest:
+        print(f"  {cumulative / 1000:>8.1f} ms  {module}")
+
+    if args.json_path:
+        write_results(args.json_path, "startup", {**summary, "heavy_loaded": heavy_loaded,
+                                                  "slowest_imports": [{"module": module, "ms": cumulative / 1000}
+                                                                      for cumulative, module in slowest]},
+                      runs=args.runs, budget_ms=args.budget_ms)
+
+    failures = []
+    if heavy_loaded:
+        failures.append(f"{', '.join(heavy_loaded)} imported at startup")
+    if args.budget_ms is not None and summary["import_ms"] > args.budget_ms:
+        failures.append(f"import took {summary['import_ms']} ms, budget is {args.budget_ms} ms")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+""" Fixtures for the endpoint tests: the app on a temporary artifact store,
+talking to benchmarks/fake_openai.py instead of the API """
+import os
+import tempfile
+
+import pytest
+
+import _common
+from fake_openai import FakeOpenAIConfig, start_fake_openai
+
+# Read when app is imported: render in-process, no warm-up, artifacts out of the tree
+os.environ["BLUEPRINT_PDF_PROCESSES"] = "0"
+os.environ["BLUEPRINT_WARMUP"] = "0"
+os.environ["BLUEPRINT_ARTIFACT_DIR"] = tempfile.mkdtemp(prefix="blueprint-artifacts-")
+
+COMPANY = {
+    "company_name": "Test Academy",
+    "product_service": "Online coding bootcamp",
+    "target_audience": "Career switchers aged 25-40",
+    "business_goal": "Double paid enrolments in 6 months",
+}
+
+
+@pytest.fixture(scope="session")
+def fake_openai():
+    config = FakeOpenAIConfig(latency=0, tokens_per_second=0, words_per_section=20, seed=1)
+    server, base_url = start_fake_openai(config)
+    yield config, base_url
+    server.shutdown()
+
+
+@pytest.fixture
+def app_module(fake_openai, monkeypatch):
+    """ The app module with its client pointed at the fake backend and a
+    fresh rate limiter and admission queue for each test """
+    import app
+
+    config, base_url = fake_openai
+    monkeypatch.setattr(app, "client", app.build_openai_client("sk-test", base_url=base_url))
+    monkeypatch.setattr(app, "rate_limiter", app.TokenBucketLimiter(0, 0))
+    monkeypatch.setattr(app, "admission_queue", app.AdmissionQueue(4, 4))
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,184 @@
+"""
+Local stand-in for the OpenAI chat completions API.
+
+    python benchmarks/fake_openai.py --port 8765 --latency 0.5 --tokens-per-second 200
+
+Serves POST /v1/chat/completions (plain and stream=True) with a blueprint-
+shaped answer: one '## ' section per SOP heading found in the prompt, or a
+JSON object keyed by the required properties of a json_schema
+response_format. Also GET /v1/models/<id> for the app's warm-up call.
+Latency before the first token, token rate and error injection are
+configurable, as is the share of sections a JSON answer leaves out, so
+load tests measure this app rather than the provider.
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECTION_PARAGRAPH = ("We will tailor this phase to the client's audience and goals with a **data-driven** plan, "
+                     "clear owners and weekly checkpoints, so progress is measurable from the first sprint. ")
+
+
+class FakeOpenAIConfig:
+    def __init__(self, latency=0.5, tokens_per_second=200.0, error_rate=0.0, words_per_section=120, seed=None,
+                 missing_rate=0.0):
+        self.latency = latency  # seconds before the first token
+        self.tokens_per_second = tokens_per_second  # 0 = no delay between tokens
+        self.error_rate = error_rate  # fraction of requests answered with HTTP 500
+        self.words_per_section = words_per_section
+        self.missing_rate = missing_rate  # fraction of JSON sections left out
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def section_body(words_per_section):
+    words = SECTION_PARAGRAPH.split()
+    return " ".join(words[i % len(words)] for i in range(words_per_section))
+
+
+def fake_blueprint(prompt, words_per_section):
+    """ Builds a reply with one section per '## ' heading in the prompt """
+    titles = re.findall(r'^## (.+)$', prompt, flags=re.MULTILINE)
+    if not titles:
+        match = re.search(r'^\s*Section: (.+)$', prompt, flags=re.MULTILINE)
+        titles = [match.group(1)] if match else ["Blueprint"]
+    body = section_body(words_per_section)
+    parts = ["Here is the proposed Performance Marketing Blueprint."]
+    for title in titles:
+        parts.append(f"## {title}\n{body}\n- Kick-off and discovery\n- Weekly reporting")
+    return "\n\n".join(parts)
+
+
+def fake_structured_blueprint(keys, words_per_section, keep=lambda key: True):
+    """ Builds a JSON reply with one Markdown body per schema key """
+    body = f"{section_body(words_per_section)}\n- Kick-off and discovery\n- Weekly reporting"
+    return json.dumps({key: body for key in keys if keep(key)})
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            # GET /v1/models/<id>: the app's warm-up call
+            if "/models/" not in self.path:
+                return self._json(404, {"error": {"message": "not found"}})
+            model = self.path.rsplit("/", 1)[-1]
+            return self._json(200, {"id": model, "object": "model", "created": 0, "owned_by": "fake"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            with config.lock:
+                config.requests += 1
+                fail = config.random.random() < config.error_rate
+            if not self.path.endswith("/chat/completions"):
+                return self._json(404, {"error": {"message": "not found"}})
+            if fail:
+                return self._json(500, {"error": {"message": "injected failure", "type": "server_error"}})
+
+            prompt = "\n".join(m.get("content") or "" for m in request.get("messages", []))
+            schema = ((request.get("response_format") or {}).get("json_schema") or {}).get("schema") or {}
+            if schema.get("required"):
+                with config.lock:
+                    keep = {key: config.random.random() >= config.missing_rate for key in schema["required"]}
+                text = fake_structured_blueprint(schema["required"], config.words_per_section, keep.get)
+            else:
+                text = fake_blueprint(prompt, config.words_per_section)
+            tokens = re.findall(r'\S+\s*', text)
+            max_tokens = request.get("max_tokens")
+            finish_reason = "stop"
+            if max_tokens and len(tokens) > max_tokens:
+                tokens, finish_reason = tokens[:max_tokens], "length"
+            usage = {"prompt_tokens": len(prompt.split()), "completion_tokens": len(tokens),
+                     "total_tokens": len(prompt.split()) + len(tokens),
+                     "prompt_tokens_details": {"cached_tokens": 0}}
+            delay = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+            time.sleep(config.latency)
+
+            base = {"id": f"chatcmpl-fake{config.requests}", "created": int(time.time()),
+                    "model": request.get("model", "gpt-4o")}
+            if not request.get("stream"):
+                time.sleep(delay * len(tokens))
+                return self._json(200, dict(base, object="chat.completion", usage=usage, choices=[{
+                    "index": 0, "finish_reason": finish_reason,
+                    "message": {"role": "assistant", "content": "".join(tokens)}}]))
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            def send(payload):
+                self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+
+            chunk = dict(base, object="chat.completion.chunk")
+            for i, token in enumerate(tokens):
+                send(dict(chunk, choices=[{"index": 0, "finish_reason": None,
+                                           "delta": {"content": token} if i else {"role": "assistant", "content": token}}]))
+                if delay:
+                    time.sleep(delay)
+            send(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": finish_reason}]))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                send(dict(chunk, choices=[], usage=usage))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    # Hundreds of clients connect at once in the async load tests
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def start_fake_openai(config=None, host="127.0.0.1", port=0):
+    """ Starts the server on a daemon thread; returns (server, base_url) """
+    server = FakeOpenAIServer((host, port), make_handler(config or FakeOpenAIConfig()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake OpenAI chat completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--words-per-section", type=int, default=120)
+    parser.add_argument("--missing-rate", type=float, default=0.0, help="Share of JSON sections left out")
+    args = parser.parse_args()
+
+    config = FakeOpenAIConfig(args.latency, args.tokens_per_second, args.error_rate, args.words_per_section,
+                              missing_rate=args.missing_rate)
+    server, base_url = start_fake_openai(config, args.host, args.port)
+    print(f"Fake OpenAI listening on {base_url} (set OPENAI_BASE_URL to use it)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Load test for /generate_blueprint against a local fake OpenAI backend.
+
+    python benchmarks/load_test.py --concurrency 1,2,4,8 --requests 16 --json results/load.json
+
+Starts benchmarks/fake_openai.py in-process, points the module-level
+`client` at it, serves the Flask app on a threaded local server and drives
+POST /generate_blueprint at each concurrency level. Reports throughput,
+p50/p95/p99 latency, error count and peak memory. Every request sends
+Cache-Control: no-cache so the response cache does not short-circuit it,
+and a company name of its own so no two requests are coalesced.
+--format html asks for the HTML preview, which skips the PDF render.
+"""
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import _common
+from _common import percentile, peak_rss_mb, write_results
+from fake_openai import FakeOpenAIConfig, start_fake_openai
+
+import httpx
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+import app
+
+COMPANY = {
+    "company_name": "Benchmark Academy",
+    "product_service": "Online coding bootcamp",
+    "target_audience": "Career switchers aged 25-40",
+    "business_goal": "Double paid enrolments in 6 months",
+    "website": "https://example.com",
+    "current_marketing": "Organic social and a monthly newsletter",
+}
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve_app():
+    server = make_server("127.0.0.1", 0, app.app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def run_level(base_url, concurrency, total_requests, path, payload):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one_request(i):
+        nonlocal errors
+        start = time.perf_counter()
+        body = dict(payload, company_name=f"{payload['company_name']} {i}")
+        try:
+            response = http.post(base_url + path, json=body, headers={"Cache-Control": "no-cache"})
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            errors += 0 if ok else 1
+
+    with httpx.Client(timeout=600) as http:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one_request, range(total_requests)))
+        wall = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": errors,
+        "seconds": round(wall, 3),
+        "throughput_per_minute": round((total_requests - errors) / wall * 60, 2),
+        "p50": round(percentile(latencies, 50), 4),
+        "p95": round(percentile(latencies, 95), 4),
+        "p99": round(percentile(latencies, 99), 4),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /generate_blueprint against a fake OpenAI backend.")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Comma separated levels")
+    parser.add_argument("--requests", type=int, default=16, help="Requests per level")
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--words-per-section", type=int, default=120)
+    parser.add_argument("--mode", choices=["single", "parallel", "structured"], default="single")
+    parser.add_argument("--missing-rate", type=float, default=0.0, help="Share of structured sections the fake omits")
+    parser.add_argument("--format", choices=["pdf", "html"], default="pdf")
+    parser.add_argument("--json", dest="json_path", help="Write results to this file")
+    args = parser.parse_args()
+
+    config = FakeOpenAIConfig(args.latency, args.tokens_per_second, args.error_rate, args.words_per_section, seed=1,
+                              missing_rate=args.missing_rate)
+    fake_server, fake_url = start_fake_openai(config)
+    app.client = app.build_openai_client("sk-benchmark", base_url=fake_url)
+    app_server, base_url = serve_app()
+
+    payload = dict(COMPANY, generation_mode=args.mode, format=args.format)
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    results = []
+    print(f"{'conc':>5} {'req/min':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7} {'rss MiB':>8}")
+    try:
+        for concurrency in levels:
+            row = run_level(base_url, concurrency, args.requests, "/generate_blueprint", payload)
+            results.append(row)
+            print(f"{concurrency:>5} {row['throughput_per_minute']:>9.1f} {row['p50']:>8.3f} {row['p95']:>8.3f} "
+                  f"{row['p99']:>8.3f} {row['errors']:>7} {row['peak_rss_mb']!s:>8}")
+    finally:
+        app_server.shutdown()
+        fake_server.shutdown()
+
+    if args.json_path:
+        write_results(args.json_path, "load_test", results, **{k: v for k, v in vars(args).items() if k != "json_path"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+""" Rate limiting and admission control: python -m pytest benchmarks/test_admission.py """
+from conftest import COMPANY
+
+NO_CACHE = {"Cache-Control": "no-cache"}
+
+
+def generate(client, remote_addr="198.51.100.7", **headers):
+    return client.post("/generate_blueprint", data=dict(COMPANY, format="html"), headers=dict(NO_CACHE, **headers),
+                       environ_base={"REMOTE_ADDR": remote_addr})
+
+
+def test_empty_bucket_is_429_with_retry_after(client, app_module, monkeypatch, fake_openai):
+    config, _ = fake_openai
+    monkeypatch.setattr(app_module, "rate_limiter", app_module.TokenBucketLimiter(1 / 60.0, 1))
+
+    assert generate(client).status_code == 200
+    requests = config.requests
+    response = generate(client)
+
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 60
+    assert config.requests == requests
+    # Another client has a bucket of its own
+    assert generate(client, remote_addr="198.51.100.8").status_code == 200
+
+
+def test_forwarded_for_is_ignored_without_a_proxy(client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "rate_limiter", app_module.TokenBucketLimiter(1 / 60.0, 1))
+
+    codes = [generate(client, **{"X-Forwarded-For": f"203.0.113.{i}"}).status_code for i in range(3)]
+
+    assert codes == [200, 429, 429]
+
+
+def test_forwarded_for_is_trusted_for_the_configured_hops(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "rate_limiter", app_module.TokenBucketLimiter(1 / 60.0, 1))
+    monkeypatch.setattr(app_module, "BLUEPRINT_PROXY_HOPS", 1)
+    client = app_module.create_app().test_client()
+
+    # Only the address the proxy appended counts; whatever the client put before it does not
+    codes = [generate(client, remote_addr="10.0.0.2", **{"X-Forwarded-For": f"203.0.113.{i}, 192.0.2.1"}).status_code
+             for i in range(3)]
+    other = generate(client, remote_addr="10.0.0.2", **{"X-Forwarded-For": "192.0.2.2"}).status_code
+
+    assert codes == [200, 429, 429]
+    assert other == 200
+
+
+def test_full_queue_is_429(client, app_module, monkeypatch, fake_openai):
+    config, _ = fake_openai
+    monkeypatch.setattr(app_module, "admission_queue", app_module.AdmissionQueue(0, 0))
+    requests = config.requests
+
+    response = generate(client)
+
+    assert response.status_code == 429
+    assert response.get_json()["error"] == "Blueprint queue is full, please retry shortly."
+    assert int(response.headers["Retry-After"]) >= 1
+    assert config.requests == requests
+
+
+def test_released_slot_goes_to_the_oldest_waiter(app_module):
+    queue = app_module.AdmissionQueue(1, 2)
+    woken = []
+
+    assert queue.acquire(timeout=0) == 'admitted'
+    with queue._lock:
+        first = queue._enter(lambda: woken.append("first"))
+        second = queue._enter(lambda: woken.append("second"))
+        assert queue._enter(lambda: woken.append("third")) == 'queue_full'
+    queue.release()
+
+    assert woken == ["first"]
+    assert queue.in_flight == 1 and list(queue._waiters) == [second]
+    assert first not in queue._waiters
@@ -0,0 +1,52 @@
+""" Section regeneration: python -m pytest benchmarks/test_regenerate_section.py """
+from conftest import COMPANY
+
+NO_CACHE = {"Cache-Control": "no-cache"}
+
+
+def generate_preview(client, **fields):
+    response = client.post("/generate_blueprint", data=dict(COMPANY, format="html", **fields), headers=NO_CACHE)
+    assert response.status_code == 200
+    return response.headers["X-Blueprint-Id"]
+
+
+def blueprint_text(client, blueprint_id):
+    response = client.get(f"/blueprints/{blueprint_id}/text")
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+def test_regenerated_section_replaces_only_its_body(client, app_module):
+    blueprint_id = generate_preview(client, sops="icp,brand,kpi")
+    before = app_module.split_blueprint_sections(blueprint_text(client, blueprint_id))
+
+    response = client.post(f"/blueprints/{blueprint_id}/sections", data={"section": "brand", "format": "html"})
+    assert response.status_code == 200
+    assert response.headers["X-Blueprint-Section"] == "Brand Building & Brand Assets"
+
+    text = blueprint_text(client, response.headers["X-Blueprint-Id"])
+    # The fake repeats the section heading in its answer; it must not end up in the text twice
+    assert text.count("Brand Building & Brand Assets") == 1
+    after = app_module.split_blueprint_sections(text)
+    assert list(after) == list(before)
+    for title in before:
+        if title != "Brand Building & Brand Assets":
+            assert after[title] == before[title]
+
+
+def test_section_outside_the_selection_is_rejected(client, fake_openai):
+    config, _ = fake_openai
+    blueprint_id = generate_preview(client, sops="icp,brand")
+    requests = config.requests
+
+    response = client.post(f"/blueprints/{blueprint_id}/sections", data={"section": "kpi"})
+    assert response.status_code == 400
+    body = response.get_json()
+    assert body["error"] == "Unknown section."
+    assert "KPI Tracking & Funnel Optimization" not in body["sections"]
+    assert config.requests == requests
+
+
+def test_unknown_blueprint_is_404(client):
+    response = client.post("/blueprints/" + "0" * 64 + "/sections", data={"section": "brand"})
+    assert response.status_code == 404
@@ -0,0 +1,50 @@
+""" SOP package selection: python -m pytest benchmarks/test_sop_selection.py """
+import pytest
+
+from conftest import COMPANY
+
+NO_CACHE = {"Cache-Control": "no-cache"}
+
+
+def generated_sops(client, app_module, **fields):
+    """ The SOP sections of a generated blueprint, without the concluding remarks """
+    response = client.post("/generate_blueprint", data=dict(COMPANY, format="html", **fields), headers=NO_CACHE)
+    assert response.status_code == 200
+    text = client.get(f"/blueprints/{response.headers['X-Blueprint-Id']}/text").get_data(as_text=True)
+    registry = app_module.get_sop_catalog().registry
+    return [title for title in app_module.split_blueprint_sections(text) if title in registry]
+
+
+def test_package_selects_its_sops(client, app_module):
+    package = client.get("/sops").get_json()["packages"]["funnel-only"]
+    titles = [app_module.get_sop_catalog().index[sop_id] for sop_id in package["sops"]]
+
+    assert generated_sops(client, app_module, sop_package="funnel-only") == titles
+
+
+def test_package_and_sops_are_merged_in_catalog_order(client, app_module):
+    sops = generated_sops(client, app_module, sop_package="funnel-only", sops="icp")
+
+    assert sops == ["Ideal Client Profile (ICP) Definition", "Specific Funnel Building (Price Point Based)",
+                    "Traffic Generation (Performance, Influencer, Organic)", "KPI Tracking & Funnel Optimization"]
+
+
+def test_no_selection_covers_the_whole_catalog(client, app_module):
+    sops = generated_sops(client, app_module)
+
+    assert sops == list(app_module.get_sop_catalog().registry)
+
+
+@pytest.mark.parametrize("fields, message", [
+    ({"sop_package": "no-such-package"}, "Unknown SOP package: no-such-package"),
+    ({"sops": "icp,no-such-sop"}, "Unknown SOPs: no-such-sop"),
+])
+def test_unknown_selection_is_rejected(client, fake_openai, fields, message):
+    config, _ = fake_openai
+    requests = config.requests
+
+    response = client.post("/generate_blueprint", data=dict(COMPANY, **fields), headers=NO_CACHE)
+
+    assert response.status_code == 400
+    assert message in response.get_json()["error"]
+    assert config.requests == requests
@@ -0,0 +1,8 @@
+""" Startup gate: python -m pytest benchmarks/test_startup.py """
+import bench_startup
+
+
+def test_no_heavy_modules_before_first_pdf():
+    result = bench_startup.run_once()
+    assert result["healthz_status"] == 200
+    assert result["heavy_loaded"] == []